@@ -0,0 +1,243 @@
+"""渲染后页面的本地归档：按内容寻址、分段压缩存储，SQLite 做索引
+
+目录结构：
+    {ARCHIVE_DIR}/index.sqlite   页面索引（url、站点、类型、内容哈希）和数据块位置
+    {ARCHIVE_DIR}/00001.seg      数据段，依次追加独立压缩的页面内容
+
+相同内容只保存一份；每个数据块单独压缩，可以按偏移量直接读取。
+优先使用 zstd（需要安装 zstandard），否则退回 zlib，数据块各自记录压缩方式。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+
+from .extraction import extract_detail, extract_list
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 只归档这两个回调处理的页面
+ARCHIVED_CALLBACKS = {'parse_list': 'list', 'parse_detail': 'detail'}
+
+
+def compress(data, level):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=level).compress(data)
+    return 'zlib', zlib.compress(data, min(level, 9))
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("归档使用了 zstd 压缩，需要安装 zstandard：pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class SegmentReader:
+    """按位置读取数据块，缓存打开的数据段文件"""
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    def read(self, segment, offset, length, codec):
+        f = self.files.get(segment)
+        if f is None:
+            f = self.files[segment] = open(os.path.join(self.path, f"{segment:05d}.seg"), 'rb')
+        f.seek(offset)
+        return decompress(codec, f.read(length))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class PageArchive:
+    def __init__(self, path, segment_size=256 * 1024 * 1024, level=3, commit_every=500):
+        self.path = path
+        self.segment_size = segment_size
+        self.level = level
+        self.commit_every = commit_every
+        os.makedirs(path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, 'index.sqlite'))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha TEXT PRIMARY KEY, segment INTEGER NOT NULL, offset INTEGER NOT NULL,
+                length INTEGER NOT NULL, size INTEGER NOT NULL, codec TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT NOT NULL, kind TEXT NOT NULL, site TEXT NOT NULL, sha TEXT NOT NULL,
+                encoding TEXT, meta TEXT, fetched_at REAL NOT NULL,
+                PRIMARY KEY (site, kind, url)
+            );
+        """)
+        self.connection.commit()
+        self.reader = SegmentReader(path)
+        self.writer = None
+        self.segment = None
+        self.pending = 0
+
+    def _open_segment(self):
+        last = self.connection.execute("SELECT MAX(segment) FROM blobs").fetchone()[0] or 1
+        path = os.path.join(self.path, f"{last:05d}.seg")
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            last += 1
+            path = os.path.join(self.path, f"{last:05d}.seg")
+        self.segment = last
+        self.writer = open(path, 'ab')
+
+    def put(self, url, kind, site, body, encoding=None, meta=None):
+        """保存页面，返回内容哈希和是否为新内容"""
+        sha = hashlib.sha256(body).hexdigest()
+        known = self.connection.execute("SELECT 1 FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        if not known:
+            if self.writer is None:
+                self._open_segment()
+            elif self.writer.tell() >= self.segment_size:
+                self.writer.close()
+                self.segment += 1
+                self.writer = open(os.path.join(self.path, f"{self.segment:05d}.seg"), 'ab')
+            codec, data = compress(body, self.level)
+            offset = self.writer.tell()
+            self.writer.write(data)
+            self.connection.execute(
+                "INSERT INTO blobs (sha, segment, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?)",
+                (sha, self.segment, offset, len(data), len(body), codec)
+            )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (url, kind, site, sha, encoding, meta, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, kind, site, sha, encoding, json.dumps(meta or {}, ensure_ascii=False), time.time())
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+        return sha, not known
+
+    def commit(self):
+        # 先把数据段落盘再提交索引，索引里的位置总是可读的
+        if self.writer is not None:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+        self.connection.commit()
+        self.pending = 0
+
+    def get(self, sha):
+        row = self.connection.execute(
+            "SELECT segment, offset, length, codec FROM blobs WHERE sha = ?", (sha,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(sha)
+        return self.reader.read(*row)
+
+    def iter_pages(self, kind, sites=None):
+        """逐条产出 (url, site, encoding, meta, segment, offset, length, codec)"""
+        sql = """
+            SELECT p.url, p.site, p.encoding, p.meta, b.segment, b.offset, b.length, b.codec
+            FROM pages p JOIN blobs b ON b.sha = p.sha
+            WHERE p.kind = ?
+        """
+        params = [kind]
+        if sites:
+            sql += f" AND p.site IN ({', '.join('?' * len(sites))})"
+            params.extend(sites)
+        # 按数据段和偏移排序，子进程读取时基本是顺序读
+        sql += " ORDER BY b.segment, b.offset"
+        for url, site, encoding, meta, segment, offset, length, codec in self.connection.execute(sql, params):
+            yield url, site, encoding, json.loads(meta), segment, offset, length, codec
+
+    def close(self):
+        self.commit()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.reader.close()
+        self.connection.close()
+
+
+class ArchiveMiddleware:
+    """爬虫中间件：把列表页和详情页的渲染结果写入归档"""
+    def __init__(self, archive, stats):
+        self.archive = archive
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        archive = PageArchive(
+            settings.get('ARCHIVE_DIR', 'page_archive'),
+            settings.getint('ARCHIVE_SEGMENT_SIZE', 256 * 1024 * 1024),
+            settings.getint('ARCHIVE_COMPRESSION_LEVEL', 3),
+        )
+        s = cls(archive, crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_input(self, response, spider):
+        callback = getattr(response.request.callback, '__name__', None)
+        kind = ARCHIVED_CALLBACKS.get(callback)
+        site_name = response.meta.get('site_name')
+        if kind is None or site_name is None:
+            return None
+        meta = {'title': response.meta.get('title')} if kind == 'detail' else {'page_no': response.meta.get('page_no', 1)}
+        _, is_new = self.archive.put(
+            response.url, kind, site_name, response.body,
+            getattr(response, 'encoding', None), meta
+        )
+        self.stats.inc_value(f'archive/{kind}_pages')
+        if is_new:
+            self.stats.inc_value('archive/new_blobs')
+            self.stats.inc_value('archive/bytes_raw', len(response.body))
+        return None
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+
+# 以下函数在重新提取的子进程中执行，站点配置由 init_worker 在进程启动时传入一次
+_worker = {}
+
+
+def init_worker(path, plan):
+    _worker['reader'] = SegmentReader(path)
+    _worker['plan'] = plan
+
+
+def _load_response(url, encoding, segment, offset, length, codec):
+    body = _worker['reader'].read(segment, offset, length, codec)
+    return HtmlResponse(url=url, body=body, encoding=encoding or 'utf-8')
+
+
+def extract_list_page(task):
+    """返回 (站点, 地址, [(标题, 详情页地址), ...] 或 None, 错误信息)"""
+    url, site, encoding, meta, segment, offset, length, codec = task
+    cfg = _worker['plan'][site]
+    try:
+        response = _load_response(url, encoding, segment, offset, length, codec)
+        _, _, entries = extract_list(response, cfg['selectors'], cfg['regex_replacements'])
+    except Exception as e:
+        return site, url, None, f"{type(e).__name__}: {e}"
+    return site, url, entries, None
+
+
+def extract_detail_page(task):
+    """返回 (站点, 地址, item 或 None, 错误信息)"""
+    url, site, encoding, title, segment, offset, length, codec = task
+    cfg = _worker['plan'][site]
+    try:
+        response = _load_response(url, encoding, segment, offset, length, codec)
+        item = extract_detail(response, site, title, cfg['selectors'], cfg['regex_replacements'])
+    except Exception as e:
+        return site, url, None, f"{type(e).__name__}: {e}"
+    return site, url, item, None
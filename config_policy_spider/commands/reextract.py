@@ -0,0 +1,35 @@
+from scrapy.commands import BaseRunSpiderCommand
+
+
+class Command(BaseRunSpiderCommand):
+    """scrapy reextract [--site 站点名 ...] [--workers N]
+
+    用当前 config.json 的选择器和正则重新处理页面归档（ARCHIVE_DIR），
+    结果走正常的 item pipeline；同样支持 -o/-s，可以写文件或写入数据库。
+    """
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Re-run the current site config over archived pages"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--site", dest="sites", action="append", default=[],
+                            help="只处理指定站点，可重复指定，默认全部站点")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="提取进程数，默认取 REEXTRACT_WORKERS 或 CPU 核数")
+
+    def run(self, args, opts):
+        self.crawler_process.crawl(
+            'gov_policy',
+            reextract=True,
+            reextract_sites=opts.sites or None,
+            reextract_workers=opts.workers,
+            **opts.spargs
+        )
+        self.crawler_process.start()
+        if self.crawler_process.bootstrap_failed:
+            self.exitcode = 1
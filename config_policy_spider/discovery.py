@@ -0,0 +1,68 @@
+"""sitemap.xml / RSS / Atom 流式解析，用于直接发现详情页 URL"""
+import io
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from lxml import etree
+
+# 需要关注的条目元素：sitemap 的 url/sitemap，RSS 的 item，Atom 的 entry
+_ENTRY_TAGS = {'url', 'sitemap', 'item', 'entry'}
+_DATE_TAGS = {'lastmod', 'pubDate', 'updated', 'published', 'date'}
+
+
+def parse_date(text):
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        value = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            value = parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def iter_entries(body):
+    """逐条产出 {'kind', 'url', 'title', 'date'}，kind 为 'sitemap'（子索引）或 'page'
+
+    使用 iterparse 边解析边清理已处理的元素，大文件不会构建完整的 DOM 树。
+    """
+    context = etree.iterparse(
+        io.BytesIO(body), events=('end',), recover=True, huge_tree=True, resolve_entities=False
+    )
+    for _, element in context:
+        if not isinstance(element.tag, str):
+            continue
+        tag = etree.QName(element).localname
+        if tag not in _ENTRY_TAGS:
+            continue
+        url = link = title = date = None
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
+            name = etree.QName(child).localname
+            if name in ('loc', 'guid') and not url:
+                url = (child.text or '').strip()
+            elif name == 'link' and not link and child.get('rel', 'alternate') == 'alternate':
+                # Atom 的 link 用 href 属性，RSS 的 link 是文本；
+                # Atom 只取第一个 alternate（或未写 rel）的链接，忽略 enclosure、self 等
+                link = (child.get('href') or child.text or '').strip()
+            elif name == 'title':
+                title = (child.text or '').strip()
+            elif name in _DATE_TAGS and date is None:
+                date = parse_date(child.text)
+        url = link or url
+        if url:
+            yield {
+                'kind': 'sitemap' if tag == 'sitemap' else 'page',
+                'url': url,
+                'title': title,
+                'date': date,
+            }
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
@@ -0,0 +1,228 @@
+"""基于可扩展布隆过滤器的 Splash 请求去重
+
+SplashAwareDupeFilter 把所有请求指纹放在内存 set 里，并在恢复运行时从 requests.seen 全量重建。
+这里改为若干段位数组（每段容量翻倍、误判率减半，总误判率不超过设定值），
+位数组以文件形式保存在 JOBDIR/bloom 下并通过 mmap 访问，恢复运行时直接映射，无需重建。
+没有 JOBDIR 时可用 DUPEFILTER_BLOOM_PATH 指定位数组文件的临时目录（避免占用匿名内存），
+但不跨运行保留：每次启动和结束时清空。未启用 DUPEFILTER_BLOOM_ENABLED 时退回 SplashAwareDupeFilter。
+"""
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+
+from scrapy.utils.job import job_dir
+from scrapy_splash import SplashAwareDupeFilter
+
+logger = logging.getLogger(__name__)
+
+# 每新增一段，容量乘以 GROWTH，误判率乘以 TIGHTENING
+GROWTH = 2
+TIGHTENING = 0.5
+
+
+class BloomSlice:
+    def __init__(self, capacity, error_rate, path=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = count
+        self.path = path
+        size = (self.bits + 7) // 8
+        self.file = None
+        if path:
+            exists = os.path.exists(path)
+            self.file = open(path, 'r+b' if exists else 'w+b')
+            if not exists or os.path.getsize(path) < size:
+                self.file.truncate(size)
+            self.data = mmap.mmap(self.file.fileno(), size)
+        else:
+            self.data = mmap.mmap(-1, size)
+
+    def _positions(self, h1, h2):
+        # 双重哈希：由两个 64 位值派生 k 个位置
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def contains(self, h1, h2):
+        data = self.data
+        for pos in self._positions(h1, h2):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        data = self.data
+        for pos in self._positions(h1, h2):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def close(self):
+        if self.file:
+            self.data.flush()
+        self.data.close()
+        if self.file:
+            self.file.close()
+
+
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity=1000000, error_rate=1e-6, path=None):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.slices = []
+        if path:
+            os.makedirs(path, exist_ok=True)
+            meta_path = os.path.join(path, 'meta.json')
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                # 已有过滤器的参数以文件为准，修改配置只影响新建的过滤器
+                self.initial_capacity = meta['initial_capacity']
+                self.error_rate = meta['error_rate']
+                for count in meta['counts']:
+                    self._add_slice(count)
+
+    def _add_slice(self, count=0):
+        index = len(self.slices)
+        capacity = self.initial_capacity * GROWTH ** index
+        error_rate = self.error_rate * (1 - TIGHTENING) * TIGHTENING ** index
+        path = os.path.join(self.path, f'slice_{index:03d}.bin') if self.path else None
+        self.slices.append(BloomSlice(capacity, error_rate, path, count))
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+    def add(self, key):
+        """加入 key，已存在（或误判为存在）时返回 True"""
+        h1, h2 = self._hash(key)
+        for s in reversed(self.slices):
+            if s.contains(h1, h2):
+                return True
+        if not self.slices or self.slices[-1].count >= self.slices[-1].capacity:
+            self._add_slice()
+        self.slices[-1].add(h1, h2)
+        return False
+
+    @property
+    def count(self):
+        return sum(s.count for s in self.slices)
+
+    @property
+    def memory_bytes(self):
+        return sum(s.size for s in self.slices)
+
+    def estimated_error_rate(self):
+        # 各段按当前填充程度估算：(1 - e^(-kn/m))^k，总误判率近似为各段之和
+        return sum(
+            (1 - math.exp(-s.hashes * s.count / s.bits)) ** s.hashes for s in self.slices
+        )
+
+    def save(self):
+        if not self.path:
+            return
+        for s in self.slices:
+            s.data.flush()
+        meta = {
+            'initial_capacity': self.initial_capacity,
+            'error_rate': self.error_rate,
+            'counts': [s.count for s in self.slices],
+        }
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.save()
+        for s in self.slices:
+            s.close()
+        self.slices = []
+
+
+class BloomSplashDupeFilter(SplashAwareDupeFilter):
+    """指纹计算与 SplashAwareDupeFilter 相同，存储换成布隆过滤器"""
+    def __init__(self, path=None, debug=False, *, fingerprinter=None,
+                 capacity=1000000, error_rate=1e-6, stats=None, resume=True):
+        # 不调用父类构造：父类会把 requests.seen 全量读入内存
+        self.file = None
+        self.fingerprints = None
+        self.fingerprinter = fingerprinter
+        self.logdupes = True
+        self.debug = debug
+        self.logger = logging.getLogger(__name__)
+        self.stats = stats
+        bloom_path = os.path.join(path, 'bloom') if path else None
+        self.resume = resume
+        if bloom_path and not resume:
+            # 不是恢复运行，上次留下的指纹不能沿用
+            shutil.rmtree(bloom_path, ignore_errors=True)
+        fresh = not (bloom_path and os.path.exists(os.path.join(bloom_path, 'meta.json')))
+        self.bloom = ScalableBloomFilter(capacity, error_rate, bloom_path)
+        if fresh and path and resume:
+            self._import_seen_file(os.path.join(path, 'requests.seen'))
+        if self.bloom.count:
+            logger.info(f"布隆去重过滤器已加载 {self.bloom.count} 条指纹，占用 {self.bloom.memory_bytes / 1024 / 1024:.1f} MB")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DUPEFILTER_BLOOM_ENABLED'):
+            return SplashAwareDupeFilter.from_crawler(crawler)
+        # 只有 JOBDIR 下的过滤器会在恢复运行时沿用；DUPEFILTER_BLOOM_PATH 仅作本次运行的文件目录，
+        # 都未设置则只在内存中（匿名 mmap）
+        jobdir = job_dir(settings)
+        path = jobdir or settings.get('DUPEFILTER_BLOOM_PATH') or None
+        return cls(
+            path,
+            settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=crawler.request_fingerprinter,
+            capacity=settings.getint('DUPEFILTER_BLOOM_CAPACITY', 1000000),
+            error_rate=settings.getfloat('DUPEFILTER_BLOOM_ERROR_RATE', 1e-6),
+            stats=crawler.stats,
+            resume=bool(jobdir),
+        )
+
+    def _import_seen_file(self, seen_path):
+        """从 set 去重切换过来时，导入已有的 requests.seen"""
+        if not os.path.exists(seen_path):
+            return
+        with open(seen_path, encoding='utf-8') as f:
+            for line in f:
+                fp = line.rstrip()
+                if fp:
+                    self.bloom.add(fp)
+        logger.info(f"已从 {seen_path} 导入 {self.bloom.count} 条请求指纹")
+
+    def request_seen(self, request):
+        seen = self.bloom.add(self.request_fingerprint(request))
+        if not seen and self.bloom.slices[-1].count == 1 and len(self.bloom.slices) > 1:
+            # 刚扩展出新的一段
+            logger.info(f"布隆去重过滤器扩展到 {len(self.bloom.slices)} 段，"
+                        f"占用 {self.bloom.memory_bytes / 1024 / 1024:.1f} MB")
+            self._record_stats()
+        return seen
+
+    def _record_stats(self):
+        if not self.stats:
+            return
+        self.stats.set_value('dupefilter/bloom/count', self.bloom.count)
+        self.stats.set_value('dupefilter/bloom/slices', len(self.bloom.slices))
+        self.stats.set_value('dupefilter/bloom/memory_bytes', self.bloom.memory_bytes)
+        self.stats.set_value('dupefilter/bloom/estimated_error_rate', f"{self.bloom.estimated_error_rate():.2e}")
+
+    def close(self, reason):
+        self._record_stats()
+        self.bloom.close()
+        if self.bloom.path and not self.resume:
+            shutil.rmtree(self.bloom.path, ignore_errors=True)
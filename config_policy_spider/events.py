@@ -0,0 +1,154 @@
+"""结构化事件通道：以 JSON 行的形式把爬虫进度推送给 main.py
+
+逐条明细按站点采样，计数类数据在本地聚合后定时发送一次，
+避免为每个 item 格式化、输出并在父进程里逐行匹配日志。
+爬虫日志和 scrapy.core.scraper 中 WARNING 及以上的记录另外转发为 log 事件。
+"""
+import json
+import logging
+import socket
+import time
+
+from scrapy import signals
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'critical': 50}
+# 这些日志里 WARNING 及以上的记录也作为 log 事件发送（爬虫自身的日志另外加入）
+FORWARDED_LOGGERS = ('scrapy.core.scraper',)
+
+
+class EventChannel:
+    def __init__(self, address, level='info', sample_rate=0.01, flush_interval=2.0, buffer_size=200):
+        self.address = address
+        self.level = LEVELS.get(level, 20)
+        # 每个站点每 sample_every 条明细事件发送一条
+        self.sample_every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.sock = None
+        self.buffer = []
+        self.counters = {}
+        self.dirty = False
+        self.sample_seen = {}
+        self.flush_task = None
+        self.crawler = None
+        self.close_reason = None
+        self.log_handler = None
+        self.log_loggers = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        channel = cls(
+            settings.get('EVENTS_ADDRESS'),
+            settings.get('EVENTS_LEVEL', 'info'),
+            settings.getfloat('EVENTS_SAMPLE_RATE', 0.01),
+            settings.getfloat('EVENTS_FLUSH_INTERVAL', 2.0),
+        )
+        crawler.signals.connect(channel.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(channel.spider_closed, signal=signals.spider_closed)
+        # 其他组件可能在 spider_closed 中仍在发送事件，等引擎停止后再关闭连接
+        crawler.signals.connect(channel.engine_stopped, signal=signals.engine_stopped)
+        channel.crawler = crawler
+        return channel
+
+    @property
+    def enabled(self):
+        return self.sock is not None
+
+    def spider_opened(self, spider):
+        if not self.address:
+            return
+        host, _, port = self.address.rpartition(':')
+        try:
+            self.sock = socket.create_connection((host, int(port)), timeout=10)
+        except (OSError, ValueError) as e:
+            logger.warning(f"事件通道连接失败 {self.address}: {e}")
+            return
+        self.flush_task = task.LoopingCall(self.flush)
+        self.flush_task.start(self.flush_interval, now=False)
+        self.log_handler = EventLogHandler(self)
+        self.log_loggers = [spider.logger.logger] + [logging.getLogger(name) for name in FORWARDED_LOGGERS]
+        for log in self.log_loggers:
+            log.addHandler(self.log_handler)
+        self.emit('info', 'spider_opened', msg="爬虫已启动")
+
+    def spider_closed(self, spider, reason):
+        self.close_reason = reason
+
+    def engine_stopped(self):
+        if not self.enabled:
+            return
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        for log in self.log_loggers:
+            log.removeHandler(self.log_handler)
+        self.log_loggers = []
+        self.flush()
+        stats = self.crawler.stats.get_stats()
+        reason = self.close_reason
+        self.emit('info', 'spider_closed', reason=reason, msg=f"爬虫已结束: {reason}",
+                  items=stats.get('item_scraped_count', 0),
+                  requests=stats.get('downloader/request_count', 0))
+        self.flush()
+        self.sock.close()
+        self.sock = None
+
+    def emit(self, level, event, site=None, **fields):
+        if not self.enabled or LEVELS.get(level, 20) < self.level:
+            return
+        record = {'ts': round(time.time(), 3), 'level': level, 'event': event}
+        if site is not None:
+            record['site'] = site
+        record.update(fields)
+        self.buffer.append(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def sample(self, site):
+        """按站点采样明细事件，每个站点的第一条总会被采样"""
+        if not self.enabled or not self.sample_every:
+            return False
+        seen = self.sample_seen.get(site, 0)
+        self.sample_seen[site] = seen + 1
+        return seen % self.sample_every == 0
+
+    def count(self, site, name, n=1):
+        site_counters = self.counters.setdefault(site, {})
+        site_counters[name] = site_counters.get(name, 0) + n
+        self.dirty = True
+
+    def flush(self):
+        if not self.enabled:
+            return
+        if self.dirty:
+            self.dirty = False
+            self.emit('info', 'counters', counters=self.counters)
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer).encode('utf-8')
+        self.buffer = []
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            logger.warning(f"事件通道写入失败，停止发送事件: {e}")
+            self.sock.close()
+            self.sock = None
+
+
+class EventLogHandler(logging.Handler):
+    """把 WARNING 及以上的日志转发为 log 事件，数据库写入失败、正则错误等也能在前端看到"""
+    def __init__(self, channel, level=logging.WARNING):
+        super().__init__(level)
+        self.channel = channel
+
+    def emit(self, record):
+        # report() 已经发送过对应的结构化事件
+        if getattr(record, 'event', None):
+            return
+        try:
+            self.channel.emit(record.levelname.lower(), 'log', logger=record.name, msg=self.format(record))
+        except Exception:
+            self.handleError(record)
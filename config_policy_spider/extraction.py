@@ -0,0 +1,102 @@
+"""按站点配置从列表页/详情页提取数据
+
+爬虫回调和离线重新提取（scrapy reextract）共用这里的函数，
+保证两条路径对同一页面得到相同的结果。函数都在模块级，可以在子进程中执行。
+"""
+import logging
+import re
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def apply_regex_replacement(field_type, text, regex_replacements, index=None, logger=logger):
+    if not text:
+        return text
+    if field_type not in regex_replacements:
+        return text
+    replacements = regex_replacements[field_type]
+    field_replacements = []
+    if field_type == "title":
+        if isinstance(replacements, list):
+            field_replacements = replacements
+    elif field_type == "content":
+        if isinstance(replacements, list):
+            if index is not None and index < len(replacements):
+                content_rules = replacements[index]
+                field_replacements = content_rules
+    for rule in field_replacements:
+        if isinstance(rule, list) and len(rule) == 2:
+            pattern, repl = rule
+            try:
+                text = re.sub(pattern, repl, text, flags=re.UNICODE)
+            except re.error as e:
+                logger.error(f"[{field_type}:{index}] 正则错误: {e}，模式: {pattern}")
+        else:
+            logger.warning(f"[{field_type}:{index}] 无效规则: {rule}，需为 [pattern, repl]")
+    return text
+
+
+def extract_list(response, selectors, regex_replacements, logger=logger):
+    """返回 (原始标题列表, 链接列表, [(处理后的标题, 详情页绝对地址), ...])"""
+    titles = response.xpath(selectors['title']).getall()
+    links = response.xpath(selectors['link']).getall()
+    entries = []
+    for title, href in zip(titles, links):
+        title = apply_regex_replacement('title', title.strip(), regex_replacements, logger=logger)
+        entries.append((title, response.urljoin(href)))
+    return titles, links, entries
+
+
+def extract_detail(response, site_name, title, selectors, regex_replacements, logger=logger):
+    if not title:
+        # sitemap 发现的链接没有标题，从详情页提取
+        title = " ".join(response.xpath(selectors.get('detail_title', '//title/text()')).get('').split())
+        title = apply_regex_replacement('title', title, regex_replacements, logger=logger)
+    result = {
+        'site': site_name,
+        'title': title,
+        'url': response.url,
+    }
+    if isinstance(selectors["content"], dict):
+        for idx, (key, value) in enumerate(selectors["content"].items()):
+            if not value or not value.strip():
+                result[key] = ""
+            else:
+                paras = response.xpath(value).getall()
+                content = "\n".join(p.strip() for p in paras if p.strip())
+                modified_content = apply_regex_replacement('content', content, regex_replacements, index=idx, logger=logger)
+                result[key] = modified_content
+    attachment_xpath = selectors.get('attachments')
+    if attachment_xpath:
+        hrefs = response.xpath(attachment_xpath).getall()
+        # 附件由 AttachmentsPipeline 直接下载，不经过 Splash
+        result['attachment_urls'] = list(dict.fromkeys(
+            response.urljoin(h.strip()) for h in hrefs if h.strip()
+        ))
+    return result
+
+
+_LIST_DATE_RE = re.compile(r'(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})')
+
+
+def parse_list_date(text):
+    """列表行中的发布日期，兼容 2024-01-02、2024/1/2、2024年1月2日 等写法"""
+    match = _LIST_DATE_RE.search(text or '')
+    if not match:
+        return None
+    try:
+        return datetime(*map(int, match.groups()), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def extract_list_dates(response, selectors):
+    """按顺序返回发布日期，站点未配置 date 选择器时返回空列表
+
+    结果只在数量与 extract_list 的条目一致时才能按位置对应，调用方需要检查。
+    """
+    date_xpath = selectors.get('date')
+    if not date_xpath:
+        return []
+    return [parse_list_date(text) for text in response.xpath(date_xpath).getall()]
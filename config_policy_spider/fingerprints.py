@@ -0,0 +1,79 @@
+"""列表页指纹：记录每个站点前 N 页的详情链接，用于跳过未更新的站点
+
+键由站点名、输出目标（PostgreSQL 表 / feed 地址）和站点配置哈希组成，
+换了输出位置或改了站点配置都会重新全量抓取。某一页只有在它的详情页全部成功输出后才记录。
+"""
+import hashlib
+import json
+import os
+
+
+def output_target(settings):
+    """本次运行的输出位置：feed 地址和启用的 PostgreSQL 表"""
+    targets = sorted(str(uri) for uri in settings.getdict('FEEDS'))
+    pipelines = settings.getwithbase('ITEM_PIPELINES')
+    if any('PostgreSQLPipeline' in str(path) and order is not None for path, order in pipelines.items()):
+        targets.append(
+            f"postgres://{settings.get('POSTGRES_HOST', 'localhost')}:{settings.get('POSTGRES_PORT', '5432')}"
+            f"/{settings.get('POSTGRES_DBNAME', 'default_db')}/{settings.get('POSTGRES_TABLE', 'gov_policies')}"
+        )
+    return ' '.join(targets)
+
+
+def store_key(site_name, target, cfg):
+    digest = hashlib.sha1(json.dumps(cfg, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f"{site_name}|{target}|{digest[:12]}"
+
+
+class ListFingerprintStore:
+    """以 JSON 文件保存 {站点键: [第1页链接列表, 第2页链接列表, ...]}"""
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        self.head_links = {}
+        self.pages = {}  # (站点键, 页码) -> 本次运行该页的链接和未完成的详情数
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.previous = json.load(f)
+
+    def seen(self, key, links):
+        """这一页的链接是否都在上次记录的前 N 页里"""
+        head = self.head_links.get(key)
+        if head is None:
+            pages = self.previous.get(key)
+            pages = pages if isinstance(pages, list) else []
+            head = self.head_links[key] = {link for page in pages if isinstance(page, list) for link in page}
+        return bool(links) and all(link in head for link in links)
+
+    def track(self, key, page_no, links, wait=True):
+        """登记本次抓到的一页；wait 为 True 时要等这些详情都成功输出后才记录"""
+        self.pages[(key, page_no)] = {
+            'links': list(dict.fromkeys(links)),
+            'pending': set(links) if wait else set(),
+            'failed': False,
+        }
+
+    def detail_done(self, key, page_no, url, success):
+        state = self.pages.get((key, page_no))
+        if state is None:
+            return
+        state['pending'].discard(url)
+        if not success:
+            state['failed'] = True
+
+    def save(self):
+        data = dict(self.previous)
+        for (key, page_no), state in self.pages.items():
+            # 还有详情没抓到（失败、被过滤或运行中断）的页不记录，下次重新比对
+            if state['pending'] or state['failed']:
+                continue
+            pages = data.get(key)
+            pages = list(pages) if isinstance(pages, list) else []
+            if page_no > len(pages):
+                pages.extend([None] * (page_no - len(pages)))
+            pages[page_no - 1] = state['links']
+            data[key] = pages
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
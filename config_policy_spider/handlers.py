@@ -0,0 +1,148 @@
+"""附件下载处理器：附件边下载边写入临时文件，不在内存中保留整个响应体
+
+附件请求（meta['attachment']）仍由 Scrapy 下载器调度，和页面请求一样经过 robots.txt、
+下载 slot（并发、DOWNLOAD_DELAY）和站点熔断中间件；只是最后一步不由 HTTP11DownloadHandler
+把响应体读入内存，而是分块写入 meta['attachment']['tmp_dir'] 下的临时文件并增量计算 sha256。
+返回的 Response 正文为空，文件信息放在 meta['attachment_file']。其余请求交给 BrowserDownloadHandler。
+附件请求不经过 HTTP 代理（meta['proxy']）。
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from scrapy.core.downloader.contextfactory import load_context_factory_from_settings
+from scrapy.http import Headers, Response
+from twisted.internet import defer, reactor
+from twisted.internet.error import TimeoutError
+from twisted.internet.protocol import Protocol
+from twisted.web.client import Agent, HTTPConnectionPool, PotentialDataLoss, ResponseDone
+from twisted.web.http_headers import Headers as TxHeaders
+from twisted.web.iweb import UNKNOWN_LENGTH
+
+from .render import BrowserDownloadHandler
+
+
+class FileBodyWriter(Protocol):
+    """把响应体分块写入文件并计算哈希；path 为 None 时（非 200 响应）只读取不保存"""
+    def __init__(self, finished, txresponse, path, maxsize):
+        self.finished = finished
+        self.txresponse = txresponse
+        self.path = path
+        self.file = open(path, 'wb') if path else None
+        self.maxsize = maxsize
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def dataReceived(self, data):
+        if self.finished.called:
+            return
+        self.size += len(data)
+        if self.maxsize and self.size > self.maxsize:
+            self.abort(ValueError(f"附件超过大小上限 {self.maxsize} 字节"))
+            return
+        if self.file:
+            self.digest.update(data)
+            self.file.write(data)
+
+    def connectionLost(self, reason):
+        self.close()
+        if self.finished.called:
+            return
+        # 没有 Content-Length、由服务器关闭连接结束的响应也算完整
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(self)
+        else:
+            self.finished.errback(reason)
+
+    def abort(self, error=None):
+        """立即断开连接；error 为 None 时由取消方（下载超时）给出错误"""
+        self.close()
+        self.txresponse._transport._producer.abortConnection()
+        if error is not None and not self.finished.called:
+            self.finished.errback(error)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class AttachmentDownloadHandler(BrowserDownloadHandler):
+    def __init__(self, settings, crawler):
+        super().__init__(settings, crawler)
+        self.attachment_pool = HTTPConnectionPool(reactor, persistent=True)
+        self.attachment_pool.maxPersistentPerHost = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.agent = Agent(
+            reactor, contextFactory=load_context_factory_from_settings(settings, crawler), pool=self.attachment_pool
+        )
+        self.default_timeout = settings.getfloat('DOWNLOAD_TIMEOUT')
+        self.default_maxsize = settings.getint('DOWNLOAD_MAXSIZE')
+
+    def download_request(self, request, spider):
+        options = request.meta.get('attachment')
+        if not options:
+            return super().download_request(request, spider)
+        return self._stream(request, options)
+
+    def _stream(self, request, options):
+        start = time.monotonic()
+        maxsize = request.meta.get('download_maxsize', self.default_maxsize)
+        headers = TxHeaders(dict(request.headers.items()))
+        dfd = self.agent.request(request.method.encode('ascii'), request.url.encode('ascii'), headers)
+
+        def _headers_received(txresponse):
+            request.meta['download_latency'] = time.monotonic() - start
+            if maxsize and txresponse.length != UNKNOWN_LENGTH and txresponse.length > maxsize:
+                txresponse._transport.loseConnection()
+                raise ValueError(f"附件大小 {txresponse.length} 字节超过上限 {maxsize} 字节")
+            path = None
+            if txresponse.code == 200:
+                fd, path = tempfile.mkstemp(dir=options.get('tmp_dir'))
+                os.close(fd)
+            finished = defer.Deferred(lambda _: writer.abort())
+            writer = FileBodyWriter(finished, txresponse, path, maxsize)
+            txresponse.deliverBody(writer)
+            finished.addCallback(self._response, request, txresponse)
+            finished.addErrback(self._discard, writer)
+            return finished
+
+        def _timed_out(failure):
+            failure.trap(defer.TimeoutError)
+            raise TimeoutError(f"附件下载超过 {timeout} 秒: {request.url}")
+
+        timeout = request.meta.get('download_timeout', self.default_timeout)
+        dfd.addCallback(_headers_received)
+        dfd.addTimeout(timeout, reactor)
+        dfd.addErrback(_timed_out)
+        return dfd
+
+    def _response(self, writer, request, txresponse):
+        if writer.path:
+            request.meta['attachment_file'] = {
+                'path': writer.path,
+                'sha256': writer.digest.hexdigest(),
+                'size': writer.size,
+            }
+        return Response(
+            url=request.url,
+            status=txresponse.code,
+            headers=Headers(dict(txresponse.headers.getAllRawHeaders())),
+            request=request,
+            flags=['attachment_stream'],
+        )
+
+    def _discard(self, failure, writer):
+        writer.close()
+        if writer.path and os.path.exists(writer.path):
+            os.remove(writer.path)
+        return failure
+
+    @defer.inlineCallbacks
+    def close(self):
+        yield super().close()
+        d = self.attachment_pool.closeCachedConnections()
+        # 与 HTTP11DownloadHandler 一样，关闭连接可能因网络问题卡住，限时等待
+        d.addTimeout(1, reactor)
+        d.addErrback(lambda _: None)
+        yield d
@@ -3,7 +3,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+from collections import deque
+
 from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from twisted.internet import defer, reactor
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
@@ -98,3 +103,260 @@ class ConfigPolicySpiderDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class SiteBreaker:
+    """单个站点的熔断器：closed → open → half_open → closed"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window, min_requests, failure_ratio, cooldown, max_cooldown, probes):
+        self.outcomes = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probes = probes
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.inflight_probes = 0
+        self.trips = 0
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def blocked(self, now):
+        """与 allow 判断相同，但不改变状态"""
+        if self.state == self.OPEN:
+            return now - self.opened_at < self.cooldown
+        return self.state == self.HALF_OPEN and self.inflight_probes >= self.probes
+
+    def retry_after(self, now):
+        return max(self.opened_at + self.cooldown - now, 0)
+
+    def allow(self, now):
+        """返回 None 表示拒绝，True 表示半开探测请求，False 表示正常放行"""
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.cooldown:
+                return None
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.inflight_probes >= self.probes:
+                return None
+            self.inflight_probes += 1
+            return True
+        return False
+
+    def release_probe(self):
+        self.inflight_probes = max(0, self.inflight_probes - 1)
+
+    def record(self, success, probe, now):
+        """记录一次请求结果，状态发生变化时返回新状态"""
+        if probe:
+            self.release_probe()
+        self.outcomes.append(success)
+        if self.state == self.HALF_OPEN and probe:
+            if success:
+                self.state = self.CLOSED
+                self.cooldown = self.base_cooldown
+                self.outcomes.clear()
+                return self.CLOSED
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            return self._trip(now)
+        if (self.state == self.CLOSED and len(self.outcomes) >= self.min_requests
+                and self.error_rate() >= self.failure_ratio):
+            return self._trip(now)
+        return None
+
+    def _trip(self, now):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.trips += 1
+        return self.OPEN
+
+
+class SiteHealthMiddleware:
+    """按站点（meta['site_name']）统计请求健康度
+
+    错误率超过阈值时熔断该站点，冷却期内暂存该站点的请求，不占用 Splash 渲染和重试名额，
+    冷却结束后重新调度；先放行少量探测请求，成功则恢复，其余请求等探测结果后再放行。
+    暂存超过 SITE_BREAKER_MAX_HOLD 秒的请求丢弃。同时按近期错误率缩减每个请求的重试次数。
+    """
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.breaker_args = (
+            settings.getint('SITE_BREAKER_WINDOW', 20),
+            settings.getint('SITE_BREAKER_MIN_REQUESTS', 5),
+            settings.getfloat('SITE_BREAKER_FAILURE_RATIO', 0.5),
+            settings.getfloat('SITE_BREAKER_COOLDOWN', 60),
+            settings.getfloat('SITE_BREAKER_MAX_COOLDOWN', 600),
+            settings.getint('SITE_BREAKER_HALF_OPEN_PROBES', 1),
+        )
+        self.failure_codes = {
+            int(code) for code in settings.getlist('SITE_BREAKER_HTTP_CODES', [500, 502, 503, 504, 408, 429])
+        }
+        self.retry_times = settings.getint('RETRY_TIMES', 2)
+        self.max_hold = settings.getfloat('SITE_BREAKER_MAX_HOLD', 1800)
+        self.breakers = {}
+        self.held = {}  # 站点名 -> 熔断期间暂存的请求（经调度器）或 Deferred（engine.download 直接下载）
+        self.timers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def _breaker(self, site_name):
+        breaker = self.breakers.get(site_name)
+        if breaker is None:
+            breaker = self.breakers[site_name] = SiteBreaker(*self.breaker_args)
+        return breaker
+
+    def request_scheduled(self, request, spider):
+        """熔断中的站点，新调度的请求先暂存，不进入调度队列"""
+        site_name = request.meta.get('site_name')
+        breaker = self.breakers.get(site_name) if site_name is not None else None
+        if breaker is None or not breaker.blocked(time.monotonic()):
+            return
+        self._hold(site_name, request)
+        # 在 request_scheduled 中抛出 IgnoreRequest，引擎不入队也不调用 errback
+        raise IgnoreRequest(f"站点 {site_name} 已熔断，暂存请求 {request.url}")
+
+    def process_request(self, request, spider):
+        site_name = request.meta.get('site_name')
+        if site_name is None:
+            return None
+        breaker = self._breaker(site_name)
+        probe = breaker.allow(time.monotonic())
+        if probe is None:
+            if request.meta.get('attachment'):
+                # engine.download 发出的请求不经过调度器，在这里等到放行后重新下载
+                held = defer.Deferred()
+                self._hold(site_name, held)
+                return held.addCallback(lambda _: request)
+            # 交回引擎重新调度，由 request_scheduled 暂存
+            return request
+        request.meta['site_health_probe'] = probe
+        if 'max_retry_times' not in request.meta or request.meta.get('site_health_budget'):
+            # 重试预算随近期错误率线性缩减，半开探测请求不重试
+            budget = 0 if probe else round(self.retry_times * (1 - breaker.error_rate()))
+            request.meta['max_retry_times'] = budget
+            request.meta['site_health_budget'] = True
+        return None
+
+    def process_response(self, request, response, spider):
+        self._record(request, response.status not in self.failure_codes, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self._record(request, False, spider)
+        elif request.meta.get('site_health_probe'):
+            # 探测请求被后续中间件忽略，没有结果，归还探测名额并放行暂存的请求
+            site_name = request.meta.get('site_name')
+            request.meta['site_health_probe'] = False
+            self._breaker(site_name).release_probe()
+            self._release(site_name)
+        return None
+
+    def _hold(self, site_name, entry):
+        now = time.monotonic()
+        if isinstance(entry, defer.Deferred):
+            held_since = now
+        else:
+            held_since = entry.meta.setdefault('site_health_held_at', now)
+        self.held.setdefault(site_name, []).append((entry, held_since))
+        self.stats.inc_value('site_health/held')
+        self.stats.inc_value(f'site_health/{site_name}/held')
+        if site_name not in self.timers:
+            self._schedule_release(site_name)
+
+    def _schedule_release(self, site_name):
+        # 熔断期间等冷却结束；半开状态等探测结果，不设定时器
+        breaker = self.breakers[site_name]
+        if breaker.state == SiteBreaker.OPEN:
+            self.timers[site_name] = reactor.callLater(
+                breaker.retry_after(time.monotonic()), self._release, site_name
+            )
+
+    def _release(self, site_name):
+        """冷却结束或探测有了结果，重新调度暂存的请求"""
+        timer = self.timers.pop(site_name, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+        now = time.monotonic()
+        for entry, held_since in self.held.pop(site_name, []):
+            if now - held_since > self.max_hold:
+                self.stats.inc_value('site_health/dropped')
+                self.stats.inc_value(f'site_health/{site_name}/dropped')
+                if isinstance(entry, defer.Deferred):
+                    entry.errback(IgnoreRequest(f"站点 {site_name} 熔断时间过长，丢弃请求"))
+                continue
+            if isinstance(entry, defer.Deferred):
+                entry.callback(None)
+            else:
+                self.crawler.engine.crawl(entry.replace(dont_filter=True))
+
+    def _record(self, request, success, spider):
+        site_name = request.meta.get('site_name')
+        if site_name is None:
+            return
+        breaker = self._breaker(site_name)
+        state = breaker.record(success, request.meta.get('site_health_probe', False), time.monotonic())
+        if state is None:
+            return
+        self.stats.set_value(f'site_health/{site_name}/state', state)
+        if state == SiteBreaker.OPEN:
+            # 暂存的请求按新的冷却时间等待
+            timer = self.timers.pop(site_name, None)
+            if timer is not None and timer.active():
+                timer.cancel()
+            if self.held.get(site_name):
+                self._schedule_release(site_name)
+            self.stats.inc_value('site_health/trips')
+            self.stats.set_value(f'site_health/{site_name}/trips', breaker.trips)
+            msg = f" 站点 {site_name} 熔断：近期错误率 {breaker.error_rate():.0%}，{breaker.cooldown:.0f} 秒后探测恢复"
+            self._report(spider, 'warning', site_name, msg, state=state,
+                         error_rate=round(breaker.error_rate(), 3), cooldown=breaker.cooldown)
+        else:
+            self._release(site_name)
+            self._report(spider, 'info', site_name, f" 站点 {site_name} 探测成功，熔断恢复", state=state)
+
+    def _report(self, spider, level, site_name, msg, **fields):
+        report = getattr(spider, 'report', None)
+        if report:
+            report(level, 'site_breaker', site_name, msg, **fields)
+        else:
+            spider.logger.warning(msg)
+
+    def spider_idle(self, spider):
+        if any(self.held.values()):
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        for timer in self.timers.values():
+            if timer.active():
+                timer.cancel()
+        self.timers = {}
+        for site_name, entries in self.held.items():
+            if entries:
+                self.stats.set_value(f'site_health/{site_name}/held_at_close', len(entries))
+            for entry, _ in entries:
+                if isinstance(entry, defer.Deferred):
+                    entry.errback(IgnoreRequest(f"爬虫已关闭，丢弃站点 {site_name} 暂存的请求"))
+        self.held = {}
+        tripped = sorted(name for name, breaker in self.breakers.items() if breaker.trips)
+        self.stats.set_value('site_health/tripped_sites', tripped)
+        for name in tripped:
+            breaker = self.breakers[name]
+            self._report(spider, 'warning', name, f" 站点 {name} 本次运行熔断 {breaker.trips} 次，最终状态 {breaker.state}",
+                         state=breaker.state, trips=breaker.trips)
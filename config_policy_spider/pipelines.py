@@ -8,8 +8,28 @@
 from itemadapter import ItemAdapter
 import psycopg2
 from psycopg2 import OperationalError
-from psycopg2.extras import execute_batch
+from psycopg2.extras import Json, execute_batch, execute_values
 import logging
+import hashlib
+import json
+import re
+from datetime import date, datetime, timezone
+import mimetypes
+import os
+import posixpath
+from urllib.parse import urlparse
+from scrapy import Request
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+from .signals import items_stored
+from .simhash import PostgresSimHashStore, SimHashIndex, SQLiteSimHashStore, simhash
+
+# 不属于正文内容的 item 字段
+META_FIELDS = ('site', 'title', 'url', 'attachment_urls', 'attachments', 'dup_cluster')
+# JSONB 存储模式下的固定列，其余字段都写入 content 列
+FIXED_COLUMNS = ('site', 'title', 'url')
+PARTITION_MODES = ('', 'month', 'site', 'site_month')
 
 
 class ConfigPolicySpiderPipeline:
@@ -17,22 +37,309 @@ class ConfigPolicySpiderPipeline:
         return item
 
 
+class NearDuplicatePipeline:
+    """用 SimHash 标记跨站点转载的近似重复政策，item 增加 dup_cluster 字段"""
+    def __init__(self, backend, path, table, max_distance, min_length, skip_content, postgres_settings):
+        self.backend = backend
+        self.path = path
+        self.table = table
+        self.min_length = min_length
+        self.skip_content = skip_content
+        self.postgres_settings = postgres_settings
+        self.index = SimHashIndex(max_distance)
+        self.store = None
+        self.pending = []
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('NEARDUP_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            settings.get('NEARDUP_BACKEND', 'sqlite'),
+            settings.get('NEARDUP_PATH', 'neardup.sqlite'),
+            settings.get('NEARDUP_TABLE', 'policy_simhash'),
+            settings.getint('NEARDUP_MAX_DISTANCE', 3),
+            settings.getint('NEARDUP_MIN_LENGTH', 50),
+            settings.getbool('NEARDUP_SKIP_CONTENT'),
+            settings.get('POSTGRES_SETTINGS'),
+        )
+        pipeline.stats = crawler.stats
+        return pipeline
+
+    def open_spider(self, spider):
+        """加载历史指纹到内存索引"""
+        if self.backend == 'postgres':
+            self.store = PostgresSimHashStore(self.postgres_settings, self.table)
+        else:
+            self.store = SQLiteSimHashStore(self.path)
+        for value, cluster, url in self.store.load():
+            self.index.add(value, cluster, url)
+        spider.logger.info(f"近似重复索引已加载 {self.index.size} 条指纹")
+
+    def close_spider(self, spider):
+        self._flush()
+        self.store.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        content_fields = [k for k in adapter.field_names() if k not in META_FIELDS]
+        text = "\n".join(str(adapter.get(k) or '') for k in content_fields)
+        if len(text) < self.min_length:
+            adapter['dup_cluster'] = ''
+            return item
+        url = adapter.get('url')
+        value = simhash(text)
+        # 重新抓取同一 url 时只和其他页面比较，不把它自己以前的版本算作重复
+        cluster = self.index.find(value, url)
+        if cluster is None:
+            cluster = f"{value:016x}"
+        else:
+            self.stats.inc_value('neardup/duplicates')
+            if self.skip_content:
+                for k in content_fields:
+                    adapter[k] = ''
+        self.index.add(value, cluster, url)
+        self.pending.append((value, cluster, url))
+        if len(self.pending) >= 100:
+            self._flush()
+        adapter['dup_cluster'] = cluster
+        return item
+
+    def _flush(self):
+        if self.pending:
+            self.store.save(self.pending)
+            self.pending = []
+
+
+class LocalAttachmentStore:
+    """本地目录存储，文件以内容哈希命名"""
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.tmp_dir = os.path.join(basedir, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.basedir, key))
+
+    def persist(self, tmp_path, key):
+        path = os.path.join(self.basedir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def uri_for(self, key):
+        return os.path.join(self.basedir, key)
+
+
+class S3AttachmentStore:
+    """S3 兼容对象存储，需要安装 boto3"""
+    def __init__(self, uri):
+        import boto3
+        from botocore.exceptions import ClientError
+        parsed = urlparse(uri)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.lstrip('/')
+        self.client = boto3.client('s3', endpoint_url=os.environ.get('AWS_ENDPOINT_URL'))
+        self.client_error = ClientError
+        self.tmp_dir = None
+
+    def _key(self, key):
+        return posixpath.join(self.prefix, key) if self.prefix else key
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self.client_error:
+            return False
+
+    def persist(self, tmp_path, key):
+        # upload_file 分片流式上传，不会把整个文件读入内存
+        self.client.upload_file(tmp_path, self.bucket, self._key(key))
+        os.remove(tmp_path)
+
+    def uri_for(self, key):
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+
+class AttachmentsPipeline:
+    """下载详情页附件，按内容哈希去重存储，并把文件引用写回 item
+
+    附件请求交给 Scrapy 下载器，和页面请求一样遵守 robots.txt、DOWNLOAD_DELAY、
+    CONCURRENT_REQUESTS_PER_DOMAIN 和站点熔断；由 AttachmentDownloadHandler 分块写入临时文件
+    并计算哈希，大文件不会读入内存。本地/S3 写入在独立线程池中进行。
+    """
+    def __init__(self, store_uri, concurrency, timeout, max_size, crawler=None):
+        self.store_uri = store_uri
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_size = max_size
+        self.crawler = crawler
+        self.store = None
+        self.threadpool = None
+        self.stats = crawler.stats if crawler else None
+        self.host_limits = {}  # 主机 -> DeferredSemaphore，限制同一主机同时排队的附件请求
+        self.url_refs = {}  # 本次运行中已处理过的附件 URL -> 文件引用
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('ATTACHMENTS_STORE', 'attachments'),
+            settings.getint('ATTACHMENTS_CONCURRENCY', 2),
+            settings.getfloat('ATTACHMENTS_TIMEOUT', 60),
+            settings.getint('ATTACHMENTS_MAX_SIZE', 200 * 1024 * 1024),
+            crawler,
+        )
+
+    def open_spider(self, spider):
+        """创建附件存储和写入线程池"""
+        if self.store_uri.startswith('s3://'):
+            self.store = S3AttachmentStore(self.store_uri)
+        else:
+            self.store = LocalAttachmentStore(self.store_uri)
+        # 写文件/上传 S3 是阻塞操作，放在独立线程池，不占用 reactor 默认线程池
+        self.threadpool = ThreadPool(minthreads=0, maxthreads=self.concurrency, name='attachments')
+        self.threadpool.start()
+
+    def close_spider(self, spider):
+        if self.threadpool:
+            self.threadpool.stop()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if 'attachment_urls' not in adapter:
+            return item
+        urls = adapter.get('attachment_urls') or []
+        del adapter['attachment_urls']
+        dfds = []
+        for url in urls:
+            if url in self.url_refs:
+                dfds.append(defer.succeed(self.url_refs[url]))
+                continue
+            # 要求原样传输，临时文件里的内容即附件本身，不需要再解压
+            request = Request(url, dont_filter=True, headers={'Accept-Encoding': 'identity'}, meta={
+                'site_name': adapter.get('site'),
+                'download_timeout': self.timeout,
+                'download_maxsize': self.max_size,
+                'attachment': {'tmp_dir': self.store.tmp_dir},
+            })
+            dfd = self._host_limit(url).run(self.crawler.engine.download, request)
+            dfd.addCallback(self._store)
+            dfd.addCallbacks(self._downloaded, self._failed, callbackArgs=(url,), errbackArgs=(url, spider))
+            dfds.append(dfd)
+        dlist = defer.gatherResults(dfds)
+
+        def _record(refs):
+            adapter['attachments'] = [ref for ref in refs if ref]
+            return item
+
+        dlist.addCallback(_record)
+        return dlist
+
+    def _host_limit(self, url):
+        host = urlparse(url).hostname or ''
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = self.host_limits[host] = defer.DeferredSemaphore(self.concurrency)
+        return limit
+
+    def _store(self, response):
+        downloaded = response.meta.get('attachment_file')
+        if response.status != 200:
+            if downloaded and os.path.exists(downloaded['path']):
+                os.remove(downloaded['path'])
+            raise ValueError(f"HTTP {response.status}")
+        if not downloaded:
+            raise ValueError("附件需要由 config_policy_spider.handlers.AttachmentDownloadHandler 下载（DOWNLOAD_HANDLERS）")
+        content_type = response.headers.get('Content-Type', b'').decode('latin-1').split(';')[0].strip().lower()
+        return threads.deferToThreadPool(
+            reactor, self.threadpool, self._persist, response.url, downloaded, content_type
+        )
+
+    def _downloaded(self, ref, url):
+        self.url_refs[url] = ref
+        self.stats.inc_value('attachments/downloaded')
+        self.stats.inc_value('attachments/bytes', ref['size'])
+        if ref['deduplicated']:
+            self.stats.inc_value('attachments/deduplicated')
+        return ref
+
+    def _failed(self, failure, url, spider):
+        self.stats.inc_value('attachments/failed')
+        spider.logger.warning(f"附件下载失败: {url} → {failure.getErrorMessage()}")
+        return None
+
+    def _persist(self, url, downloaded, content_type):
+        """在线程池中把已下载的临时文件按内容哈希保存"""
+        tmp_path = downloaded['path']
+        sha256 = downloaded['sha256']
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if not ext or len(ext) > 6:
+            ext = mimetypes.guess_extension(content_type) or ''
+        key = f"{sha256[:2]}/{sha256}{ext}"
+        try:
+            deduplicated = self.store.exists(key)
+            if not deduplicated:
+                self.store.persist(tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return {
+            'url': url,
+            'path': self.store.uri_for(key),
+            'sha256': sha256,
+            'size': downloaded['size'],
+            'content_type': content_type,
+            'deduplicated': deduplicated,
+        }
+
+
 class PostgreSQLPipeline:
-    def __init__(self, postgres_settings):
+    def __init__(self, postgres_settings, storage_mode='columns', gin_index='jsonb_path_ops', batch_size=10,
+                 partition_by='', retention_months=0, retention_drop=True, stats=None):
         self.postgres_settings = postgres_settings
         self.connection = None
         self.batch_data = []
-        self.batch_size = 10
+        self.batch_size = batch_size
         self.table_validated = False
         self.can_write = False  # 控制是否允许写入
         self.expected_columns = None  # 期望的列结构
+        # columns：每个字段一列，要求表结构与 item 完全一致
+        # jsonb：固定列 site/title/url，其余字段写入 content JSONB 列，不同站点可共用一张表
+        self.storage_mode = storage_mode
+        self.gin_index = gin_index
+        # 分区方式：''（不分区）、month、site、site_month
+        self.partition_by = partition_by
+        self.retention_months = retention_months
+        self.retention_drop = retention_drop
+        self.partitions = set()  # 本次运行已确认存在的分区
+        self.stats = stats
+        self.first_written = False
+        self.first_flushed = False  # 首条数据单独立即写入一次，不等批次攒满；失败后也不再逐条写入
         
     @classmethod
     def from_crawler(cls, crawler):
         postgres_settings = crawler.settings.get("POSTGRES_SETTINGS")
         if not postgres_settings:
             raise ValueError("POSTGRES_SETTINGS not found in spider settings")
-        return cls(postgres_settings)
+        storage_mode = crawler.settings.get('POSTGRES_STORAGE_MODE', 'columns')
+        if storage_mode not in ('columns', 'jsonb'):
+            raise ValueError(f"POSTGRES_STORAGE_MODE 需为 columns 或 jsonb，当前为 {storage_mode}")
+        partition_by = crawler.settings.get('POSTGRES_PARTITION_BY', '') or ''
+        if partition_by not in PARTITION_MODES:
+            raise ValueError(f"POSTGRES_PARTITION_BY 需为 {PARTITION_MODES} 之一，当前为 {partition_by}")
+        return cls(
+            postgres_settings,
+            storage_mode,
+            crawler.settings.get('POSTGRES_JSONB_GIN_INDEX', 'jsonb_path_ops'),
+            crawler.settings.getint('POSTGRES_BATCH_SIZE', 10),
+            partition_by,
+            crawler.settings.getint('POSTGRES_RETENTION_MONTHS', 0),
+            crawler.settings.getbool('POSTGRES_RETENTION_DROP', True),
+            crawler.stats,
+        )
     
     def open_spider(self, spider):
         """爬虫开始时创建数据库连接"""
@@ -59,10 +366,10 @@ class PostgreSQLPipeline:
             spider.logger.info("PostgreSQL 连接已关闭")
     
     def process_item(self, item, spider):
-        """处理每个item，累积批量数据"""
+        """处理每个item，累积批量数据；无法写入时丢弃 item，不算作成功输出"""
         if not self.connection:
             spider.logger.error("PostgreSQL 连接不存在")
-            return item
+            raise DropItem("PostgreSQL 连接不存在")
             
         # 验证表结构
         if not self.table_validated:
@@ -71,7 +378,9 @@ class PostgreSQLPipeline:
             
             if not self.can_write:
                 spider.logger.error("表结构验证失败，停止数据写入")
-                return item
+                raise DropItem("表结构验证失败")
+            if self.partition_by:
+                self._init_partitioning(spider)
         
         # 只有验证通过才允许写入
         if self.can_write:
@@ -79,15 +388,19 @@ class PostgreSQLPipeline:
             self.batch_data.append(dict(item))
             
             # 达到批处理大小时执行插入
-            if len(self.batch_data) >= self.batch_size:
+            if len(self.batch_data) >= self.batch_size or not self.first_flushed:
+                self.first_flushed = True
                 self._insert_batch(spider)
         else:
             spider.logger.warning("由于表结构不匹配，跳过数据写入")
+            raise DropItem("表结构不匹配")
         
         return item
     
     def _validate_table_structure(self, item, spider):
         """验证表结构是否与item匹配"""
+        if self.storage_mode == 'jsonb':
+            return self._validate_jsonb_table(spider)
         table_name = self.postgres_settings['table']
         cursor = self.connection.cursor()
         
@@ -116,15 +429,7 @@ class PostgreSQLPipeline:
                 for clean_field in self.expected_columns:
                     columns.append(f"{clean_field} TEXT")
                 
-                create_table_sql = f"""
-                CREATE TABLE IF NOT EXISTS {table_name} (
-                    id SERIAL PRIMARY KEY,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    {', '.join(columns)}
-                );
-                """
-                
-                cursor.execute(create_table_sql)
+                cursor.execute(self._create_table_sql(table_name, ', '.join(columns)))
                 self.connection.commit()
                 spider.logger.info(f"表 {table_name} 创建成功，列: {self.expected_columns}")
                 return True
@@ -170,10 +475,232 @@ class PostgreSQLPipeline:
         finally:
             cursor.close()
     
+    def _create_table_sql(self, table_name, columns_sql):
+        """建表语句；分区表的主键必须包含分区键"""
+        if not self.partition_by:
+            return f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id SERIAL PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                {columns_sql}
+            );
+            """
+        if self.partition_by == 'month':
+            primary_key, partition_clause = "id, created_at", "RANGE (created_at)"
+        elif self.partition_by == 'site':
+            primary_key, partition_clause = "id, site", "LIST (site)"
+        else:
+            primary_key, partition_clause = "id, site, created_at", "LIST (site)"
+        return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id SERIAL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            {columns_sql},
+            PRIMARY KEY ({primary_key})
+        ) PARTITION BY {partition_clause};
+        CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+        """
+    
+    def _init_partitioning(self, spider):
+        """确认表确实是分区表，并按保留期限摘除过期的月分区"""
+        table_name = self.postgres_settings['table']
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT p.partstrat FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = %s
+            """, (table_name,))
+            if cursor.fetchone() is None:
+                spider.logger.warning(f"表 {table_name} 已存在且不是分区表，忽略 POSTGRES_PARTITION_BY={self.partition_by}")
+                self.partition_by = ''
+                return
+            if self.retention_months > 0:
+                if self.partition_by == 'site':
+                    spider.logger.warning("按站点分区的表没有月分区，POSTGRES_RETENTION_MONTHS 不生效")
+                else:
+                    self._apply_retention(cursor, table_name, spider)
+            self.connection.commit()
+        except Exception as e:
+            spider.logger.error(f"初始化分区时出错: {e}")
+            self.connection.rollback()
+        finally:
+            cursor.close()
+    
+    def _apply_retention(self, cursor, table_name, spider):
+        """摘除（并默认删除）早于保留期限的月分区，代替大批量 DELETE"""
+        today = date.today()
+        months = today.year * 12 + today.month - 1 - self.retention_months
+        cutoff = (months // 12) * 100 + months % 12 + 1
+        cursor.execute("""
+            SELECT child.relname, parent.relname
+            FROM pg_inherits i
+            JOIN pg_class child ON child.oid = i.inhrelid
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            WHERE parent.relname = %s OR parent.relname LIKE %s
+        """, (table_name, f"{table_name}_s%"))
+        for child, parent in cursor.fetchall():
+            match = re.search(r'_(\d{6})$', child)
+            if not match or int(match.group(1)) >= cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {child}")
+            if self.retention_drop:
+                cursor.execute(f"DROP TABLE {child}")
+                spider.logger.info(f"已摘除并删除过期分区 {child}")
+            else:
+                spider.logger.info(f"已摘除过期分区 {child}（保留为独立表）")
+    
+    def _ensure_partitions(self, spider):
+        """为本批数据所需的站点/月份创建分区，已存在则跳过"""
+        table_name = self.postgres_settings['table']
+        today = date.today()
+        # created_at 由数据库填充，同时预建下个月的分区，避免月初数据落入默认分区
+        months = [today.replace(day=1)]
+        months.append(date(today.year + today.month // 12, today.month % 12 + 1, 1))
+        wanted = []
+        sites = sorted({item_data.get('site') or '' for item_data in self.batch_data})
+        if self.partition_by == 'month':
+            wanted = [(None, month) for month in months]
+        elif self.partition_by == 'site':
+            wanted = [(site, None) for site in sites]
+        else:
+            wanted = [(site, None) for site in sites] + [(site, month) for site in sites for month in months]
+        cursor = self.connection.cursor()
+        try:
+            for site, month in wanted:
+                if (site, month) in self.partitions:
+                    continue
+                cursor.execute("SAVEPOINT create_partition")
+                try:
+                    cursor.execute(self._partition_sql(table_name, site, month))
+                    cursor.execute("RELEASE SAVEPOINT create_partition")
+                except psycopg2.Error as e:
+                    # 默认分区里已有属于该范围的数据时无法建分区，数据继续写入默认分区
+                    cursor.execute("ROLLBACK TO SAVEPOINT create_partition")
+                    spider.logger.warning(f"创建分区失败，数据将写入默认分区: {e}")
+                self.partitions.add((site, month))
+            self.connection.commit()
+        finally:
+            cursor.close()
+    
+    def _partition_sql(self, table_name, site, month):
+        site_table = f"{table_name}_s{hashlib.md5(site.encode('utf-8')).hexdigest()[:8]}" if site is not None else None
+        if month is not None:
+            next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            parent = site_table or table_name
+            return f"""
+            CREATE TABLE IF NOT EXISTS {parent}_{month:%Y%m} PARTITION OF {parent}
+            FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')
+            """
+        sub_partition = ""
+        if self.partition_by == 'site_month':
+            sub_partition = "PARTITION BY RANGE (created_at)"
+        sql = f"""
+        CREATE TABLE IF NOT EXISTS {site_table} PARTITION OF {table_name}
+        FOR VALUES IN (%s) {sub_partition}
+        """
+        with self.connection.cursor() as cursor:
+            sql = cursor.mogrify(sql, (site,)).decode('utf-8')
+        if sub_partition:
+            sql += f"; CREATE TABLE IF NOT EXISTS {site_table}_default PARTITION OF {site_table} DEFAULT"
+        return sql
+    
+    def _validate_jsonb_table(self, spider):
+        """JSONB 模式：表不存在则创建，存在则只检查固定列和 content 列"""
+        table_name = self.postgres_settings['table']
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT column_name, data_type
+                FROM information_schema.columns
+                WHERE table_name = %s
+            """, (table_name,))
+            existing_columns = dict(cursor.fetchall())
+            
+            if not existing_columns:
+                fixed_columns = ', '.join(f"{col} TEXT" for col in FIXED_COLUMNS)
+                cursor.execute(self._create_table_sql(
+                    table_name, f"{fixed_columns}, content JSONB NOT NULL DEFAULT '{{}}'::jsonb"
+                ))
+                spider.logger.info(f"表 {table_name} 创建成功（JSONB 模式）")
+            else:
+                missing = [col for col in FIXED_COLUMNS + ('content',) if col not in existing_columns]
+                if missing:
+                    spider.logger.error(f"❌ 表 {table_name} 缺少 JSONB 模式所需的列: {missing}")
+                    return False
+                if existing_columns['content'] != 'jsonb':
+                    spider.logger.error(f"❌ 表 {table_name} 的 content 列类型为 {existing_columns['content']}，需为 jsonb")
+                    return False
+            
+            if self.gin_index:
+                # jsonb_path_ops 索引更小，支持 @> 包含查询；jsonb_ops 额外支持 ? 键存在查询
+                cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table_name}_content_gin
+                ON {table_name} USING GIN (content {self.gin_index})
+                """)
+            self.connection.commit()
+            self.expected_columns = list(FIXED_COLUMNS) + ['content']
+            spider.logger.info("✅ 表结构验证通过（JSONB 模式）")
+            return True
+        except Exception as e:
+            spider.logger.error(f"验证表结构时出错: {e}")
+            self.connection.rollback()
+            return False
+        finally:
+            cursor.close()
+    
+    def _insert_jsonb_batch(self, spider):
+        """JSONB 模式批量插入，动态字段整体写入 content 列"""
+        table_name = self.postgres_settings['table']
+        cursor = self.connection.cursor()
+        try:
+            rows = []
+            for item_data in self.batch_data:
+                fixed = [item_data.get(col) or '' for col in FIXED_COLUMNS]
+                content = {k: v for k, v in item_data.items() if k not in FIXED_COLUMNS}
+                rows.append((*fixed, Json(content)))
+            execute_values(
+                cursor,
+                f"INSERT INTO {table_name} ({', '.join(self.expected_columns)}) VALUES %s",
+                rows,
+                page_size=self.batch_size
+            )
+            self.connection.commit()
+            spider.logger.info(f"成功插入 {len(self.batch_data)} 条数据到 {table_name}")
+            self._batch_stored(spider, True)
+            self.batch_data.clear()
+            self._record_first_write()
+        except Exception as e:
+            spider.logger.error(f"批量插入数据时出错: {e}")
+            self.connection.rollback()
+            self._batch_stored(spider, False)
+        finally:
+            cursor.close()
+    
+    def _batch_stored(self, spider, success):
+        """通知本批数据是否已提交（列表页指纹要等详情真正写入后才记录）"""
+        spider.crawler.signals.send_catch_log(
+            signal=items_stored, items=list(self.batch_data), success=success, spider=spider
+        )
+
+    def _record_first_write(self):
+        if self.first_written:
+            return
+        self.first_written = True
+        start_time = self.stats.get_value('start_time') if self.stats else None
+        if start_time is not None:
+            seconds = (datetime.now(timezone.utc) - start_time).total_seconds()
+            self.stats.set_value('freshness/time_to_first_write', round(seconds, 3))
+    
     def _insert_batch(self, spider):
         """批量插入数据到PostgreSQL"""
         if not self.batch_data or not self.can_write:
             return
+        if self.partition_by:
+            self._ensure_partitions(spider)
+        if self.storage_mode == 'jsonb':
+            self._insert_jsonb_batch(spider)
+            return
             
         table_name = self.postgres_settings['table']
         cursor = self.connection.cursor()
@@ -207,6 +734,8 @@ class PostgreSQLPipeline:
                     # 处理可能的None值
                     if value is None:
                         value = ''
+                    elif isinstance(value, (list, dict)):
+                        value = json.dumps(value, ensure_ascii=False)
                     row_values.append(str(value))
                 
                 batch_values.append(tuple(row_values))
@@ -216,15 +745,18 @@ class PostgreSQLPipeline:
             self.connection.commit()
             
             spider.logger.info(f"成功插入 {len(self.batch_data)} 条数据到 {table_name}")
+            self._batch_stored(spider, True)
             
             # 清空批处理列表
             self.batch_data.clear()
+            self._record_first_write()
             
         except Exception as e:
             spider.logger.error(f"批量插入数据时出错: {e}")
             spider.logger.error(f"SQL: {insert_sql}")
             spider.logger.error(f"期望列数: {len(self.expected_columns)}, 实际数据列数: {len(batch_values[0]) if batch_values else 0}")
             self.connection.rollback()
+            self._batch_stored(spider, False)
             # 不抛出异常，避免中断爬虫
         finally:
             cursor.close()
@@ -0,0 +1,205 @@
+"""可按站点切换的页面渲染后端：static（直接下载）、splash、browser（本地无头浏览器池）
+
+站点在 config.json 中用 "render" 指定后端，可以是字符串，也可以是
+{"backend": "browser", "list_wait": 3, "detail_wait": 1}。解析回调不关心页面由谁渲染。
+"""
+import asyncio
+import time
+
+import scrapy
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import HtmlResponse
+from scrapy.utils.defer import deferred_from_coro
+from scrapy_splash import SplashRequest
+from twisted.internet import defer
+
+DEFAULT_WAITS = {'list_wait': 3, 'detail_wait': 1}
+
+
+def render_options(cfg, default_backend):
+    render = cfg.get('render') or default_backend
+    if isinstance(render, str):
+        render = {'backend': render}
+    # 只写了等待时间的 dict 也使用默认后端
+    options = {'backend': default_backend, **DEFAULT_WAITS}
+    options.update(render)
+    if options['backend'] == 'none':
+        options['backend'] = 'static'
+    if options['backend'] not in BACKENDS:
+        raise ValueError(f"未知的渲染后端: {options['backend']}，可选 {sorted(BACKENDS)}")
+    return options
+
+
+def static_request(url, callback, meta, wait, splash_args=None, **kwargs):
+    return scrapy.Request(url=url, callback=callback, meta=meta, **kwargs)
+
+
+def splash_request(url, callback, meta, wait, splash_args=None, **kwargs):
+    args = {'wait': wait}
+    args.update(splash_args or {})
+    return SplashRequest(url=url, callback=callback, meta=meta, args=args, **kwargs)
+
+
+def browser_request(url, callback, meta, wait, splash_args=None, **kwargs):
+    meta = dict(meta, browser_render={'wait': wait})
+    return scrapy.Request(url=url, callback=callback, meta=meta, **kwargs)
+
+
+class RenderError(Exception):
+    pass
+
+
+BACKENDS = {
+    'static': static_request,
+    'splash': splash_request,
+    'browser': browser_request,
+}
+
+
+def build_request(options, kind, url, callback, meta, **kwargs):
+    """按站点渲染配置构造请求，kind 为 'list' 或 'detail'"""
+    meta = dict(meta, render_backend=options['backend'])
+    wait = options[f'{kind}_wait']
+    return BACKENDS[options['backend']](url, callback, meta, wait, **kwargs)
+
+
+class BrowserPool:
+    """固定数量的浏览器上下文，每个上下文持有一个复用的页面"""
+    def __init__(self, size, browser_type, headless, timeout):
+        self.size = size
+        self.browser_type = browser_type
+        self.headless = headless
+        self.timeout = timeout
+        self.playwright = None
+        self.browser = None
+        self.pages = None
+        self.started = False
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.lock:
+            if self.started:
+                return
+            from playwright.async_api import async_playwright
+            self.playwright = await async_playwright().start()
+            launcher = getattr(self.playwright, self.browser_type)
+            self.browser = await launcher.launch(headless=self.headless)
+            # 队列里的 None 是空位，使用时再创建页面
+            self.pages = asyncio.Queue()
+            for _ in range(self.size):
+                self.pages.put_nowait(None)
+            self.started = True
+
+    async def _new_page(self):
+        context = await self.browser.new_context()
+        page = await context.new_page()
+        page.set_default_timeout(self.timeout * 1000)
+        return page
+
+    async def render(self, url, wait):
+        await self.start()
+        page = await self.pages.get()
+        try:
+            if page is None:
+                page = await self._new_page()
+            response = await page.goto(url, wait_until='load')
+            if wait:
+                await page.wait_for_timeout(wait * 1000)
+            html = await page.content()
+            return page.url, response.status if response else 200, html
+        except Exception:
+            # 出错的页面可能停在未知状态，关闭它，空位留给下次请求换新的上下文
+            if page is not None:
+                try:
+                    await page.context.close()
+                except Exception:
+                    pass
+            page = None
+            raise
+        finally:
+            self.pages.put_nowait(page)
+
+    async def close(self):
+        if not self.started:
+            return
+        await self.browser.close()
+        await self.playwright.stop()
+        self.started = False
+
+
+class BrowserDownloadHandler(HTTP11DownloadHandler):
+    """http/https 下载处理器：meta 带 browser_render 的请求用浏览器池渲染，其余请求走默认 HTTP 下载
+
+    浏览器渲染在下载处理器中进行，和普通下载一样占用下载器 slot，
+    遵守 CONCURRENT_REQUESTS_PER_DOMAIN 和 DOWNLOAD_DELAY。
+    """
+    def __init__(self, settings, crawler):
+        super().__init__(settings, crawler)
+        self.stats = crawler.stats
+        self.pool = BrowserPool(
+            settings.getint('BROWSER_POOL_SIZE', 4),
+            settings.get('BROWSER_TYPE', 'chromium'),
+            settings.getbool('BROWSER_HEADLESS', True),
+            settings.getfloat('BROWSER_RENDER_TIMEOUT', 30),
+        )
+
+    def download_request(self, request, spider):
+        options = request.meta.get('browser_render')
+        if options is None:
+            return super().download_request(request, spider)
+        return deferred_from_coro(self._render(request, options))
+
+    async def _render(self, request, options):
+        start = time.monotonic()
+        try:
+            url, status, html = await self.pool.render(request.url, options.get('wait'))
+        except ImportError:
+            raise RenderError("browser 渲染后端需要安装 playwright：pip install playwright && playwright install")
+        except Exception as e:
+            # 作为下载错误抛出，熔断中间件会把它计入站点错误率
+            self.stats.inc_value('render/browser/errors')
+            raise RenderError(f"浏览器渲染失败 {request.url}: {e}") from e
+        # 与 HTTP 下载一致记录耗时，RenderMiddleware 据此按后端统计
+        request.meta['download_latency'] = time.monotonic() - start
+        return HtmlResponse(url=url, status=status, body=html, encoding='utf-8', request=request)
+
+    @defer.inlineCallbacks
+    def close(self):
+        yield super().close()
+        yield deferred_from_coro(self.pool.close())
+
+
+class RenderMiddleware:
+    """按渲染后端统计页面下载/渲染耗时"""
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_response(self, request, response, spider):
+        backend = request.meta.get('render_backend')
+        if backend and 'download_latency' in request.meta:
+            self._record(backend, request.meta['download_latency'], request)
+        return response
+
+    def _record(self, backend, seconds, request):
+        ms = round(seconds * 1000)
+        self.stats.inc_value(f'render/{backend}/count')
+        self.stats.inc_value(f'render/{backend}/latency_ms_total', ms)
+        self.stats.max_value(f'render/{backend}/latency_ms_max', ms)
+        site_name = request.meta.get('site_name')
+        if site_name:
+            self.stats.inc_value(f'render/{backend}/{site_name}/latency_ms_total', ms)
+            self.stats.inc_value(f'render/{backend}/{site_name}/count')
+
+    def spider_closed(self, spider):
+        for backend in BACKENDS:
+            count = self.stats.get_value(f'render/{backend}/count')
+            if count:
+                total = self.stats.get_value(f'render/{backend}/latency_ms_total', 0)
+                self.stats.set_value(f'render/{backend}/latency_ms_avg', round(total / count))
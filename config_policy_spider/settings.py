@@ -100,3 +100,105 @@ HTTPCACHE_STORAGE = 'scrapy_splash.persistences.SplashCacheStorage'
 # Set user-agent for requests
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
 
+
+# 附件下载（AttachmentsPipeline）
+# 附件经 Scrapy 下载器获取，遵守 robots.txt、DOWNLOAD_DELAY、CONCURRENT_REQUESTS_PER_DOMAIN 和站点熔断；
+# 由 config_policy_spider.handlers.AttachmentDownloadHandler 边下载边写入临时文件，不占用整份内存
+# 存储位置：本地目录，或 s3://bucket/prefix（需要 boto3）
+ATTACHMENTS_STORE = 'attachments'
+# 每个主机同时排队下载的附件数，同时也是存储写入线程数
+ATTACHMENTS_CONCURRENCY = 2
+# 单个附件的下载超时（秒）和大小上限（字节，超过则放弃）
+ATTACHMENTS_TIMEOUT = 60
+ATTACHMENTS_MAX_SIZE = 200 * 1024 * 1024
+
+# 近似重复检测（NearDuplicatePipeline），开启后 item 增加 dup_cluster 字段
+NEARDUP_ENABLED = False
+# 指纹持久化：sqlite（本地文件 NEARDUP_PATH）或 postgres（表 NEARDUP_TABLE）
+NEARDUP_BACKEND = 'sqlite'
+NEARDUP_PATH = 'neardup.sqlite'
+NEARDUP_TABLE = 'policy_simhash'
+NEARDUP_MAX_DISTANCE = 3
+NEARDUP_MIN_LENGTH = 50
+# 重复文档只保留标题和链接，不再存储正文
+NEARDUP_SKIP_CONTENT = False
+
+# 列表页指纹：记录前 N 页中详情全部成功输出的链接，列表页链接都已抓取过时跳过站点/停止翻页，设为 0 强制全量抓取
+# 按站点名、输出目标（POSTGRES_TABLE 或 feed 地址）和站点配置区分
+LIST_FINGERPRINT_PAGES = 3
+LIST_FINGERPRINT_FILE = 'list_fingerprints.json'
+
+# 站点熔断（SiteHealthMiddleware）：最近 WINDOW 个请求中错误率达到 FAILURE_RATIO 时熔断
+SITE_BREAKER_WINDOW = 20
+SITE_BREAKER_MIN_REQUESTS = 5
+SITE_BREAKER_FAILURE_RATIO = 0.5
+# 熔断冷却时间（秒），半开探测失败后翻倍，最长 MAX_COOLDOWN
+SITE_BREAKER_COOLDOWN = 60
+SITE_BREAKER_MAX_COOLDOWN = 600
+# 熔断期间请求暂存，冷却结束后重新调度；暂存超过该时长（秒）的请求丢弃
+SITE_BREAKER_MAX_HOLD = 1800
+SITE_BREAKER_HALF_OPEN_PROBES = 1
+SITE_BREAKER_HTTP_CODES = [500, 502, 503, 504, 408, 429]
+
+# 结构化事件通道（config_policy_spider.events.EventChannel），由 main.py 通过 -s EVENTS_ADDRESS=host:port 传入
+EVENTS_ADDRESS = ''
+EVENTS_LEVEL = 'info'
+# 逐条明细事件（列表页、详情页）的按站点采样比例，计数总是完整聚合
+EVENTS_SAMPLE_RATE = 0.01
+EVENTS_FLUSH_INTERVAL = 2.0
+
+# 渲染后端：static（直接下载）、splash、browser（本地无头浏览器池，需要 playwright）
+# 站点可在 config.json 中用 "render" 单独指定
+RENDER_BACKEND = 'splash'
+BROWSER_POOL_SIZE = 4
+BROWSER_TYPE = 'chromium'
+BROWSER_HEADLESS = True
+BROWSER_RENDER_TIMEOUT = 30
+# browser 后端基于 asyncio 版 playwright，需要 asyncio reactor；对所有抓取生效（Scrapy 2.13 起也是默认值），
+# 依赖默认 reactor 行为的扩展需确认兼容
+TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+
+# PostgreSQLPipeline 存储模式：columns（每个字段一列）或 jsonb（site/title/url + content JSONB）
+POSTGRES_STORAGE_MODE = 'columns'
+# JSONB 模式下 content 列的 GIN 索引操作符类，留空则不建索引
+POSTGRES_JSONB_GIN_INDEX = 'jsonb_path_ops'
+POSTGRES_BATCH_SIZE = 100
+
+# 分区表：''（不分区）、month（按 created_at 月份）、site（按站点）、site_month（先按站点再按月份）
+# 只在新建表时生效，写入时自动创建所需分区
+POSTGRES_PARTITION_BY = ''
+# 保留最近 N 个月的月分区，更早的分区直接摘除，0 表示不清理
+POSTGRES_RETENTION_MONTHS = 0
+# 摘除后是否删除分区表；False 时保留为独立表以便归档
+POSTGRES_RETENTION_DROP = True
+
+# 页面归档：保存渲染后的列表页和详情页，配合 scrapy reextract 离线重新提取
+ARCHIVE_ENABLED = False
+ARCHIVE_DIR = 'page_archive'
+# 单个数据段文件的大小上限（字节）
+ARCHIVE_SEGMENT_SIZE = 256 * 1024 * 1024
+# zstd 压缩级别（未安装 zstandard 时使用 zlib，最高 9）
+ARCHIVE_COMPRESSION_LEVEL = 3
+# 重新提取的进程数，0 表示使用 CPU 核数；每次分发给子进程的页面数
+REEXTRACT_WORKERS = 0
+REEXTRACT_CHUNK_SIZE = 64
+COMMANDS_MODULE = 'config_policy_spider.commands'
+
+# 新鲜度优先：详情页优先级 = FRESHNESS_DETAIL_PRIORITY - 距今天数（上限 FRESHNESS_MAX_AGE_DAYS）
+# 站点配置了 selectors.date 且日期数与条目数一致时取列表行的发布日期，否则按每深一页约 FRESHNESS_PAGE_DAYS 天估计
+FRESHNESS_PRIORITY_ENABLED = True
+FRESHNESS_DETAIL_PRIORITY = 1000
+FRESHNESS_PAGE_DAYS = 7
+FRESHNESS_MAX_AGE_DAYS = 365
+# 同一优先级内按发现顺序（列表页从上到下）调度
+SCHEDULER_MEMORY_QUEUE = 'scrapy.squeues.FifoMemoryQueue'
+SCHEDULER_DISK_QUEUE = 'scrapy.squeues.PickleFifoDiskQueue'
+
+# 布隆过滤器去重：内存占用固定且可控，指纹保存在 JOBDIR/bloom（或 DUPEFILTER_BLOOM_PATH）并通过 mmap 访问
+DUPEFILTER_BLOOM_ENABLED = False
+# 第一段的容量，超出后自动追加容量翻倍的新段
+DUPEFILTER_BLOOM_CAPACITY = 1000000
+# 总误判率上限；误判会导致个别新请求被当作重复丢弃
+DUPEFILTER_BLOOM_ERROR_RATE = 1e-6
+# 没有 JOBDIR 时位数组文件的存放目录，只在本次运行内有效，启动和结束时清空；跨运行恢复请使用 JOBDIR
+DUPEFILTER_BLOOM_PATH = ''
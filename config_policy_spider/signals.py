@@ -0,0 +1,4 @@
+"""项目自定义信号，用法同 scrapy.signals"""
+
+# 批量写入数据库结束：items 为这一批数据，success 表示是否已提交
+items_stored = object()
@@ -0,0 +1,177 @@
+"""SimHash 近似重复检测：64 位指纹 + 分段倒排索引
+
+安装了 numpy 时按位投票用矩阵运算完成，否则退回逐位循环，两种方式得到的指纹相同。
+"""
+import hashlib
+import re
+import sqlite3
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+_NOISE_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def _shingles(text, size=3):
+    """中文文本没有天然分词边界，按字符 n-gram 取特征"""
+    text = _NOISE_RE.sub('', text)
+    if len(text) <= size:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def _shingle_hashes(shingles):
+    return b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+
+
+def simhash(text):
+    shingles = _shingles(text)
+    if numpy is not None:
+        return _simhash_numpy(shingles)
+    weights = [0] * HASH_BITS
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(HASH_BITS):
+            if h >> bit & 1:
+                weights[bit] += count
+            else:
+                weights[bit] -= count
+    value = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            value |= 1 << bit
+    return value
+
+
+def _simhash_numpy(shingles):
+    if not shingles:
+        return 0
+    # 用浮点矩阵乘法（走 BLAS），计数远小于 2**53，结果是精确的
+    counts = numpy.fromiter(shingles.values(), dtype=numpy.float64, count=len(shingles))
+    # 摘要按大端解释为整数，倒转字节后按小端展开，第 i 列即第 i 位
+    digests = numpy.frombuffer(_shingle_hashes(shingles), dtype=numpy.uint8).reshape(-1, 8)[:, ::-1]
+    bits = numpy.unpackbits(digests, axis=1, bitorder='little')
+    # 每一位的权重 = 置 1 的计数 - 置 0 的计数
+    weights = 2 * (counts @ bits) - counts.sum()
+    return int.from_bytes(numpy.packbits(weights > 0, bitorder='little').tobytes(), 'little')
+
+
+def _to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class SimHashIndex:
+    """内存倒排索引：指纹切成 4 段，海明距离 <= 3 的两个指纹必有一段完全相同"""
+    def __init__(self, max_distance=3):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance 需小于分段数 {BANDS}")
+        self.max_distance = max_distance
+        self.buckets = {}
+        self.size = 0
+
+    def _keys(self, value):
+        return [(band, value >> (band * BAND_BITS) & BAND_MASK) for band in range(BANDS)]
+
+    def add(self, value, cluster, url=None):
+        entry = (value, cluster, url)
+        for key in self._keys(value):
+            self.buckets.setdefault(key, []).append(entry)
+        self.size += 1
+
+    def find(self, value, url=None):
+        """返回最近的已知指纹所属簇，没有则返回 None；同一 url 以前的指纹不算重复"""
+        best = None
+        for key in self._keys(value):
+            for other, cluster, other_url in self.buckets.get(key, ()):
+                if url is not None and other_url == url:
+                    continue
+                distance = (value ^ other).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, cluster)
+                    if distance == 0:
+                        return cluster
+        return best[1] if best else None
+
+
+def _latest_per_url(rows):
+    """同一批次内同一 url 只保留最后一条，避免 upsert 冲突"""
+    latest = {}
+    for i, (value, cluster, url) in enumerate(rows):
+        latest[url if url is not None else i] = (_to_signed(value), cluster, url)
+    return list(latest.values())
+
+
+class SQLiteSimHashStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS simhash (hash INTEGER NOT NULL, cluster TEXT NOT NULL, url TEXT UNIQUE)"
+        )
+        self.connection.commit()
+
+    def load(self):
+        for value, cluster, url in self.connection.execute("SELECT hash, cluster, url FROM simhash"):
+            yield _to_unsigned(value), cluster, url
+
+    def save(self, rows):
+        self.connection.executemany(
+            "INSERT INTO simhash (hash, cluster, url) VALUES (?, ?, ?) "
+            "ON CONFLICT (url) DO UPDATE SET hash = excluded.hash, cluster = excluded.cluster",
+            _latest_per_url(rows)
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class PostgresSimHashStore:
+    def __init__(self, postgres_settings, table):
+        import psycopg2
+        self.table = table
+        self.connection = psycopg2.connect(
+            database=postgres_settings['dbname'],
+            user=postgres_settings['user'],
+            password=postgres_settings['password'],
+            host=postgres_settings['host'],
+            port=postgres_settings['port']
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (hash BIGINT NOT NULL, cluster TEXT NOT NULL, url TEXT UNIQUE)"
+            )
+        self.connection.commit()
+
+    def load(self):
+        # 命名游标分批拉取，避免一次性把百万行读进客户端
+        with self.connection.cursor(name='simhash_load') as cursor:
+            cursor.itersize = 50000
+            cursor.execute(f"SELECT hash, cluster, url FROM {self.table}")
+            for value, cluster, url in cursor:
+                yield _to_unsigned(value), cluster, url
+
+    def save(self, rows):
+        from psycopg2.extras import execute_values
+        with self.connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                f"INSERT INTO {self.table} (hash, cluster, url) VALUES %s "
+                f"ON CONFLICT (url) DO UPDATE SET hash = excluded.hash, cluster = excluded.cluster",
+                _latest_per_url(rows)
+            )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
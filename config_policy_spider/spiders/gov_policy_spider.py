@@ -1,21 +1,46 @@
 import json
+import logging
+import multiprocessing
+import os
 import re
+from datetime import datetime, timedelta, timezone
 import scrapy
-from scrapy_splash import SplashRequest
+from scrapy import signals
+from scrapy.utils.gz import gunzip
+from ..render import build_request, render_options
+from ..discovery import iter_entries
+from ..events import EventChannel
+from ..fingerprints import ListFingerprintStore, output_target, store_key
+from ..signals import items_stored
+from ..extraction import apply_regex_replacement, extract_detail, extract_list, extract_list_dates
+from ..archive import PageArchive, extract_detail_page, extract_list_page, init_worker
 
 class GovPolicySpider(scrapy.Spider):
     name = "gov_policy"
+    # 由 scrapy reextract 命令设置：不抓取，改为重新提取归档页面
+    reextract = False
+    reextract_sites = None
+    reextract_workers = None
     custom_settings = {
         'SPLASH_URL': 'http://localhost:8050',
         'DOWNLOADER_MIDDLEWARES': {
+            'config_policy_spider.middlewares.SiteHealthMiddleware': 560,
+            'config_policy_spider.render.RenderMiddleware': 700,
             'scrapy_splash.SplashCookiesMiddleware': 723,
             'scrapy_splash.SplashMiddleware': 725,
             'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
         },
         'SPIDER_MIDDLEWARES': {
+            'config_policy_spider.archive.ArchiveMiddleware': 60,
             'scrapy_splash.SplashDeduplicateArgsMiddleware': 100,
         },
-        'DUPEFILTER_CLASS': 'scrapy_splash.SplashAwareDupeFilter',
+        # 未开启 DUPEFILTER_BLOOM_ENABLED 时等同于 scrapy_splash.SplashAwareDupeFilter
+        'DUPEFILTER_CLASS': 'config_policy_spider.dupefilters.BloomSplashDupeFilter',
+        # browser 渲染后端和附件流式下载都作为下载处理器运行，受下载器 slot 的并发和延迟限制
+        'DOWNLOAD_HANDLERS': {
+            'http': 'config_policy_spider.handlers.AttachmentDownloadHandler',
+            'https': 'config_policy_spider.handlers.AttachmentDownloadHandler',
+        },
         'HTTPCACHE_STORAGE': 'scrapy_splash.SplashAwareFSCacheStorage',
         'FEED_EXPORT_ENCODING': 'utf-8',
         'LOG_LEVEL': 'INFO',
@@ -25,6 +50,8 @@ class GovPolicySpider(scrapy.Spider):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36',
         },
         'ITEM_PIPELINES': {
+            'config_policy_spider.pipelines.NearDuplicatePipeline': 150,
+            'config_policy_spider.pipelines.AttachmentsPipeline': 200,
             'config_policy_spider.pipelines.PostgreSQLPipeline': 300,
         }
     }
@@ -41,122 +68,367 @@ class GovPolicySpider(scrapy.Spider):
             'table': crawler.settings.get('POSTGRES_TABLE', 'gov_policies')
         }
         crawler.settings.set('POSTGRES_SETTINGS', spider.postgres_settings)
+        # 只对前 N 页列表做指纹比对，0 表示关闭（强制全量抓取）
+        spider.fingerprint_pages = crawler.settings.getint('LIST_FINGERPRINT_PAGES', 3)
+        spider.fingerprints = None
+        if spider.fingerprint_pages > 0:
+            spider.fingerprints = ListFingerprintStore(
+                crawler.settings.get('LIST_FINGERPRINT_FILE', 'list_fingerprints.json')
+            )
+            spider.output_target = output_target(crawler.settings)
+        # (站点, 详情 URL) -> 所属列表页，批量写入数据库失败时据此把列表页标记为未完成
+        spider.fingerprint_items = {}
+        spider.discovery_state = {}
+        spider.events = EventChannel.from_crawler(crawler)
+        # 站点未配置 render 时使用的默认渲染后端
+        spider.render_backend = crawler.settings.get('RENDER_BACKEND', 'splash')
+        # 新鲜度优先：详情页按发布日期（或列表页深度）排优先级，越新越先抓取
+        spider.freshness_enabled = crawler.settings.getbool('FRESHNESS_PRIORITY_ENABLED', True)
+        spider.freshness_priority = crawler.settings.getint('FRESHNESS_DETAIL_PRIORITY', 1000)
+        spider.freshness_page_days = crawler.settings.getint('FRESHNESS_PAGE_DAYS', 7)
+        spider.freshness_max_age = crawler.settings.getint('FRESHNESS_MAX_AGE_DAYS', 365)
+        spider.first_item_seen = False
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(spider.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(spider.item_error, signal=signals.item_error)
+        crawler.signals.connect(spider.items_stored, signal=items_stored)
         return spider
 
-    def start_requests(self):
+    def report(self, level, event, site_name, msg, **fields):
+        """站点级的少量进度信息：同时写日志并发送结构化事件"""
+        self.logger.log(logging.getLevelName(level.upper()), msg, extra={'event': event})
+        self.events.emit(level, event, site=site_name, msg=msg.strip(), **fields)
+
+    def detail_priority(self, page_no, published=None):
+        """有发布日期时按距今天数，否则按列表页深度估计天数；始终高于列表页请求的优先级"""
+        if not self.freshness_enabled:
+            return 0
+        if published is not None:
+            age = (datetime.now(timezone.utc) - published).days
+        else:
+            age = (page_no - 1) * self.freshness_page_days
+        return self.freshness_priority - min(max(age, 0), self.freshness_max_age)
+
+    def list_priority(self, page_no):
+        # 各站点靠前的列表页先于更深的翻页
+        return -(page_no - 1) if self.freshness_enabled else 0
+
+    def fingerprint_detail_done(self, response, success):
+        page = response.meta.get('fingerprint_page') if response is not None else None
+        if page and self.fingerprints:
+            self.fingerprints.detail_done(*page, success)
+
+    def item_dropped(self, item, response, exception, spider):
+        self.fingerprint_detail_done(response, False)
+
+    def item_error(self, item, response, spider, failure):
+        self.fingerprint_detail_done(response, False)
+
+    def items_stored(self, items, success, spider):
+        # item_scraped 时数据可能还在管道的批次里，写入失败要撤销对应列表页的记录
+        for item in items:
+            pages = self.fingerprint_items.pop((item.get('site'), item.get('url')), [])
+            if not success:
+                for page in pages:
+                    self.fingerprints.detail_done(*page, False)
+
+    def item_scraped(self, item, response, spider):
+        self.fingerprint_detail_done(response, True)
+        if self.first_item_seen:
+            return
+        self.first_item_seen = True
+        start_time = self.crawler.stats.get_value('start_time')
+        if start_time is None:
+            return
+        seconds = round((datetime.now(timezone.utc) - start_time).total_seconds(), 3)
+        self.crawler.stats.set_value('freshness/time_to_first_item', seconds)
+        self.report('info', 'first_item', item.get('site'),
+                    f" 首条数据用时 {seconds} 秒: {item.get('title')}", seconds=seconds, url=item.get('url'))
+
+    def closed(self, reason):
+        # 只记录详情全部成功输出的页，中断的运行也不会漏抓
+        if self.fingerprints:
+            self.fingerprints.save()
+
+    def load_config(self):
         with open('config.json', encoding='utf-8') as f:
             cfg_list = json.load(f)
         if not isinstance(cfg_list, list):
             self.logger.error("config.json 格式错误，需为列表包裹多个配置")
+            return []
+        return cfg_list
+
+    def start_requests(self):
+        if self.reextract:
+            # 本地 data: 请求不经过网络，只用来在引擎里触发重新提取的回调
+            yield scrapy.Request('data:,', callback=self.reextract_archive, dont_filter=True)
             return
-        for cfg in cfg_list:
+        for cfg in self.load_config():
             site_name = cfg['name']
             start_url = cfg['url']
             selectors = cfg['selectors']
             regex_replacements = cfg.get('regex_replacements', {})
-            self.logger.info(f" 开始抓取: {site_name} → {start_url}")
+            self.report('info', 'site_started', site_name, f" 开始抓取: {site_name} → {start_url}", url=start_url)
             meta = {
                 'site_name': site_name,
                 'selectors': selectors,
-                'regex_replacements': regex_replacements
+                'regex_replacements': regex_replacements,
+                'render': render_options(cfg, self.render_backend),
+                'page_no': 1
             }
-            yield SplashRequest(
-                url=start_url,
-                callback=self.parse_list,
-                meta=meta,
-                args={
-                    'wait': 3,
-                    'render_all': 1
-                },
+            if self.fingerprints:
+                meta['fingerprint_key'] = store_key(site_name, self.output_target, cfg)
+            discovery = cfg.get('discovery')
+            if discovery:
+                yield from self.start_discovery(cfg, discovery, meta)
+            else:
+                yield self.start_list_request(start_url, meta)
+
+    def start_list_request(self, start_url, meta):
+        return build_request(
+            meta['render'], 'list',
+            url=start_url,
+            callback=self.parse_list,
+            meta=meta,
+            splash_args={'render_all': 1},
+            dont_filter=True
+        )
+
+    def detail_request(self, detail_url, title, site_name, selectors, regex_replacements, render, priority=0,
+                       fingerprint_page=None):
+        detail_meta = {
+            'title': title,
+            'site_name': site_name,
+            'selectors': selectors,
+            'regex_replacements': regex_replacements
+        }
+        kwargs = {}
+        if fingerprint_page:
+            # 列表页指纹要等该页详情全部成功后才记录
+            detail_meta['fingerprint_page'] = fingerprint_page
+            kwargs['errback'] = self.detail_failed
+        return build_request(
+            render, 'detail',
+            url=detail_url,
+            callback=self.parse_detail,
+            meta=detail_meta,
+            priority=priority,
+            **kwargs
+        )
+
+    def detail_failed(self, failure):
+        request = failure.request
+        self.logger.error(f"详情页抓取失败 {request.url}: {failure.getErrorMessage()}")
+        self.fingerprints.detail_done(*request.meta['fingerprint_page'], False)
+
+    def start_discovery(self, cfg, discovery, meta):
+        """优先从 sitemap/RSS 发现详情页，全部源都没有结果时回退到列表页渲染"""
+        sources = list(discovery.get('sitemaps', [])) + list(discovery.get('feeds', []))
+        if not sources:
+            yield self.start_list_request(cfg['url'], meta)
+            return
+        since_days = discovery.get('since_days')
+        url_pattern = discovery.get('url_pattern')
+        self.discovery_state[meta['site_name']] = {
+            'pending': len(sources),
+            'found': 0,
+            'since': datetime.now(timezone.utc) - timedelta(days=since_days) if since_days else None,
+            'url_pattern': re.compile(url_pattern) if url_pattern else None,
+            'fallback': discovery.get('fallback', True),
+            'start_url': cfg['url'],
+            'list_meta': meta,
+        }
+        for source in sources:
+            yield scrapy.Request(
+                url=source,
+                callback=self.parse_discovery,
+                errback=self.discovery_failed,
+                meta=dict(meta),
                 dont_filter=True
             )
 
+    def parse_discovery(self, response):
+        meta = response.meta
+        site_name = meta['site_name']
+        state = self.discovery_state[site_name]
+        body = response.body
+        if body[:2] == b'\x1f\x8b':
+            body = gunzip(body)
+        found = 0
+        for entry in iter_entries(body):
+            url = response.urljoin(entry['url'])
+            if entry['kind'] == 'sitemap':
+                state['pending'] += 1
+                yield scrapy.Request(
+                    url=url,
+                    callback=self.parse_discovery,
+                    errback=self.discovery_failed,
+                    meta=dict(meta),
+                    dont_filter=True
+                )
+                continue
+            if state['since'] and entry['date'] and entry['date'] < state['since']:
+                continue
+            if state['url_pattern'] and not state['url_pattern'].search(url):
+                continue
+            title = entry['title']
+            if title:
+                title = apply_regex_replacement('title', title, meta['regex_replacements'], logger=self.logger)
+            found += 1
+            yield self.detail_request(url, title, site_name, meta['selectors'], meta['regex_replacements'], meta['render'],
+                                      priority=self.detail_priority(1, entry['date']))
+        state['found'] += found
+        self.report('info', 'discovery_source', site_name,
+                    f" {site_name} 从 {response.url} 发现 {found} 条详情链接", url=response.url, found=found)
+        yield from self.finish_discovery_source(site_name)
+
+    def discovery_failed(self, failure):
+        site_name = failure.request.meta['site_name']
+        self.report('warning', 'discovery_failed', site_name,
+                    f" {site_name} 获取 {failure.request.url} 失败: {failure.getErrorMessage()}",
+                    url=failure.request.url)
+        yield from self.finish_discovery_source(site_name)
+
+    def finish_discovery_source(self, site_name):
+        state = self.discovery_state[site_name]
+        state['pending'] -= 1
+        if state['pending'] == 0 and state['found'] == 0 and state['fallback']:
+            self.report('info', 'discovery_fallback', site_name,
+                        f" {site_name} 未从 sitemap/RSS 发现详情页，回退到列表页抓取")
+            yield self.start_list_request(state['start_url'], state['list_meta'])
+
     def parse_list(self, response):
         meta = response.meta
         site_name = meta['site_name']
         selectors = meta['selectors']
         regex_replacements = meta['regex_replacements']
-        self.logger.info(f" 解析列表页: {response.url}")
-        titles = response.xpath(selectors['title']).getall()
-        links  = response.xpath(selectors['link']).getall()
-        self.logger.info(f" 列表页共找到 {len(titles)} 条标题，{len(links)} 条链接")
+        titles, links, entries = extract_list(response, selectors, regex_replacements, logger=self.logger)
+        self.logger.debug(" 解析列表页: %s，共找到 %d 条标题，%d 条链接", response.url, len(titles), len(links))
+        self.events.count(site_name, 'list_pages')
+        if self.events.sample(site_name):
+            self.events.emit('info', 'list_page', site=site_name, url=response.url, titles=len(titles), links=len(links))
         if not titles or not links:
-            self.logger.warning(f" 在 {response.url} 未找到标题或链接，请检查 XPath 选择器或页面加载问题。")
-        for idx, (title, href) in enumerate(zip(titles, links)):
-            title = title.strip()
-            title = self.apply_regex_replacement('title', title, regex_replacements)
-            detail_url = response.urljoin(href)
-            self.logger.info(f" 准备抓取详情: {title} → {detail_url}")
-            detail_meta = {
-                'title': title,
-                'site_name': site_name,
-                'selectors': selectors,
-                'regex_replacements': regex_replacements
-            }
-            yield SplashRequest(
-                url=detail_url,
-                callback=self.parse_detail,
-                meta=detail_meta,
-                args={'wait': 1},
-            )
+            self.report('warning', 'list_empty', site_name,
+                        f" 在 {response.url} 未找到标题或链接，请检查 XPath 选择器或页面加载问题。", url=response.url)
+        page_no = meta.get('page_no', 1)
+        fingerprint_key = meta.get('fingerprint_key')
+        tracked = False
+        if self.fingerprints and fingerprint_key and entries:
+            detail_urls = [detail_url for _, detail_url in entries]
+            tracked = page_no <= self.fingerprint_pages
+            if self.fingerprints.seen(fingerprint_key, detail_urls):
+                if tracked:
+                    self.fingerprints.track(fingerprint_key, page_no, detail_urls, wait=False)
+                if page_no == 1:
+                    self.crawler.stats.inc_value('list_fingerprint/sites_skipped')
+                    self.report('info', 'site_unchanged', site_name, f" {site_name} 列表首页链接上次都已抓取，跳过该站点")
+                else:
+                    self.crawler.stats.inc_value('list_fingerprint/pages_unchanged')
+                    self.report('info', 'page_unchanged', site_name,
+                                f" {site_name} 第 {page_no} 页链接上次都已抓取，停止翻页", page_no=page_no)
+                return
+            if tracked:
+                self.fingerprints.track(fingerprint_key, page_no, detail_urls)
+        dates = extract_list_dates(response, selectors)
+        if dates and len(dates) != len(entries):
+            # 日期按位置和条目对应，数量不一致（某行缺日期等）时无法确定对应关系，改按列表页深度估计
+            self.crawler.stats.inc_value('freshness/date_mismatch')
+            self.logger.debug(" %s 提取到 %d 个日期、%d 个条目，按页码估计新鲜度", response.url, len(dates), len(entries))
+            dates = []
+        for idx, (title, detail_url) in enumerate(entries):
+            self.logger.debug(" 准备抓取详情: %s → %s", title, detail_url)
+            priority = self.detail_priority(page_no, dates[idx] if dates else None)
+            yield self.detail_request(detail_url, title, site_name, selectors, regex_replacements, meta['render'],
+                                      priority=priority,
+                                      fingerprint_page=(fingerprint_key, page_no, detail_url) if tracked else None)
+        self.events.count(site_name, 'detail_requests', len(entries))
         next_href = response.xpath(selectors['next_page']).get()
         if next_href:
             next_url = response.urljoin(next_href)
-            self.logger.info(f" 跟进下一页: {next_url}")
-            yield SplashRequest(
+            self.logger.debug(" 跟进下一页: %s", next_url)
+            next_meta = {
+                'site_name': site_name,
+                'selectors': selectors,
+                'regex_replacements': regex_replacements,
+                'render': meta['render'],
+                'page_no': page_no + 1
+            }
+            if fingerprint_key:
+                next_meta['fingerprint_key'] = fingerprint_key
+            yield build_request(
+                meta['render'], 'list',
                 url=next_url,
                 callback=self.parse_list,
-                meta=meta,
-                args={'wait': 3},
+                meta=next_meta,
+                priority=self.list_priority(page_no + 1),
             )
         else:
-            self.logger.info(" 没有找到下一页，列表解析结束。")
+            self.report('info', 'list_finished', site_name, " 没有找到下一页，列表解析结束。", page_no=page_no)
 
     def parse_detail(self, response):
         meta = response.meta
-        title = meta['title']
         site_name = meta['site_name']
-        selectors = meta['selectors']
-        regex_replacements = meta['regex_replacements']
-        self.logger.info(f" 解析详情页: {title} → {response.url}")
-        result = {
-            'site': site_name,
-            'title': title,
-            'url': response.url,
-        }
-        if isinstance(selectors["content"], dict):
-            for idx, (key, value) in enumerate(selectors["content"].items()):
-                if not value or not value.strip():
-                    result[key] = ""
-                else:
-                    paras = response.xpath(value).getall()
-                    content = "\n".join(p.strip() for p in paras if p.strip())
-                    modified_content = self.apply_regex_replacement('content', content, regex_replacements, index = idx)
-                    result[key] = modified_content
+        result = extract_detail(response, site_name, meta['title'], meta['selectors'], meta['regex_replacements'],
+                                logger=self.logger)
+        self.logger.debug(" 解析详情页: %s → %s", result['title'], response.url)
+        self.events.count(site_name, 'items')
+        if self.events.sample(site_name):
+            self.events.emit('info', 'item', site=site_name, title=result['title'], url=response.url)
+        if meta.get('fingerprint_page'):
+            self.fingerprint_items.setdefault((site_name, result['url']), []).append(meta['fingerprint_page'])
         yield result
 
-    def apply_regex_replacement(self, field_type, text, regex_replacements, index=None):
-        if not text:
-            return text
-        if field_type not in regex_replacements:
-            return text
-        replacements = regex_replacements[field_type]
-        field_replacements = []
-        if field_type == "title":
-            if isinstance(replacements, list):
-                field_replacements = replacements
-        elif field_type == "content":
-            if isinstance(replacements, list):
-                if index is not None and index < len(replacements):
-                    content_rules = replacements[index]
-                    field_replacements = content_rules
-        for rule in field_replacements:
-            if isinstance(rule, list) and len(rule) == 2:
-                pattern, repl = rule
-                try:
-                    text = re.sub(pattern, repl, text, flags=re.UNICODE)
-                except re.error as e:
-                    self.logger.error(f"[{field_type}:{index}] 正则错误: {e}，模式: {pattern}")
-            else:
-                self.logger.warning(f"[{field_type}:{index}] 无效规则: {rule}，需为 [pattern, repl]")
-        return text
\ No newline at end of file
+    def reextract_archive(self, response):
+        """用当前 config.json 重新提取归档中的页面，结果照常进入 item pipeline
+
+        先并行解析列表页得到详情页标题，再并行解析详情页；子进程只读数据段，
+        索引在这里一次性读出。
+        """
+        stats = self.crawler.stats
+        plan = {
+            cfg['name']: {'selectors': cfg['selectors'], 'regex_replacements': cfg.get('regex_replacements', {})}
+            for cfg in self.load_config()
+        }
+        sites = [site for site in (self.reextract_sites or plan) if site in plan]
+        missing = set(self.reextract_sites or ()) - set(plan)
+        if missing:
+            self.logger.warning(f"config.json 中没有这些站点，跳过: {sorted(missing)}")
+        settings = self.crawler.settings
+        archive = PageArchive(settings.get('ARCHIVE_DIR', 'page_archive'))
+        try:
+            list_tasks = list(archive.iter_pages('list', sites))
+            detail_pages = list(archive.iter_pages('detail', sites))
+        finally:
+            archive.close()
+        if not detail_pages:
+            self.logger.warning(f"归档 {archive.path} 中没有可重新提取的详情页")
+            return
+        workers = int(self.reextract_workers or settings.getint('REEXTRACT_WORKERS', 0) or os.cpu_count() or 1)
+        chunk_size = settings.getint('REEXTRACT_CHUNK_SIZE', 64)
+        self.logger.info(f" 开始重新提取: {len(list_tasks)} 个列表页，{len(detail_pages)} 个详情页，{workers} 个进程")
+        # spawn 方式启动子进程，不继承 reactor 和线程池的状态，Windows 下行为一致
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(workers, initializer=init_worker, initargs=(archive.path, plan)) as pool:
+            titles = {}
+            for site, url, entries, error in pool.imap_unordered(extract_list_page, list_tasks, chunk_size):
+                stats.inc_value('reextract/list_pages')
+                if error:
+                    stats.inc_value('reextract/errors')
+                    self.logger.error(f"重新提取列表页失败 {url}: {error}")
+                    continue
+                for title, detail_url in entries:
+                    titles.setdefault(detail_url, title)
+            detail_tasks = [
+                (url, site, encoding, titles.get(url) or meta.get('title'), segment, offset, length, codec)
+                for url, site, encoding, meta, segment, offset, length, codec in detail_pages
+            ]
+            for site, url, item, error in pool.imap_unordered(extract_detail_page, detail_tasks, chunk_size):
+                stats.inc_value('reextract/detail_pages')
+                if error:
+                    stats.inc_value('reextract/errors')
+                    self.logger.error(f"重新提取详情页失败 {url}: {error}")
+                    continue
+                self.events.count(site, 'items')
+                yield item
+        self.logger.info(f" 重新提取完成: {stats.get_value('reextract/detail_pages', 0)} 个详情页，"
+                         f"{stats.get_value('reextract/errors', 0)} 个错误")
@@ -5,16 +5,32 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import subprocess
 import asyncio
-import re
+import socket
 import psutil
 import threading
-from queue import Queue
+from queue import Queue, Empty
 from typing import List, Optional, Dict, Any, Union
 import signal
+import os
+import math
+import uuid
+import time
+import sqlite3
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from collections import OrderedDict
+import urllib.parse
+import urllib.request
 import pandas as pd
-import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import execute_batch
+from psycopg2.extensions import make_dsn
+from fastapi.concurrency import run_in_threadpool
+from scrapy.http import HtmlResponse
+from config_policy_spider.extraction import extract_detail, extract_list
+from config_policy_spider.render import BrowserPool, render_options
+from config_policy_spider.spiders.gov_policy_spider import GovPolicySpider
 import ast
 
 app = FastAPI()
@@ -52,10 +68,17 @@ class FormData(BaseModel):
     link: str
     content: Dict[str, str]
     next_page: str
+    attachments: Optional[str] = None
+    date: Optional[str] = None
+    detail_title: Optional[str] = None
+    render: Optional[Union[str, dict[str, Any]]] = None
     regex_replacements: Optional[dict[str, Any]] = None
+    discovery: Optional[dict[str, Any]] = None
 
 class AddressData(BaseModel):
     address: str
+    memory_limit_mb: Optional[int] = None
+    cpu_limit: Optional[float] = None
 
 class ProcessRequest(BaseModel):
     pid: int
@@ -67,20 +90,109 @@ class PostgresConfig(BaseModel):
     host: str
     port: str
     table: str
+    storage_mode: Optional[str] = None
+    partition_by: Optional[str] = None
+    retention_months: Optional[int] = None
+    memory_limit_mb: Optional[int] = None
+    cpu_limit: Optional[float] = None
 
-def create_db_connection(db_name, db_user, db_password, db_host, db_port):
-    connection = None
+class ScheduleRequest(BaseModel):
+    name: str
+    cron: str
+    priority: int = 0
+    stagger_seconds: int = 0
+    address: Optional[str] = None
+    postgres: Optional[PostgresConfig] = None
+    enabled: bool = True
+
+class ScheduleToggle(BaseModel):
+    enabled: bool
+
+class PreviewRequest(BaseModel):
+    url: str
+    title: str
+    link: str
+    next_page: Optional[str] = None
+    content: Optional[Dict[str, str]] = None
+    detail_url: Optional[str] = None
+    detail_title: Optional[str] = None
+    attachments: Optional[str] = None
+    regex_replacements: Optional[dict[str, Any]] = None
+    render: Optional[Union[str, Dict[str, Any]]] = None
+    name: Optional[str] = None
+    refresh: bool = False
+    limit: int = 20
+
+DB_POOL_MINCONN = 1
+DB_POOL_MAXCONN = 10
+DB_POOL_ACQUIRE_TIMEOUT = 30
+
+# 按 DSN 共享的连接池：{dsn: {"pool", "slots", "in_use", "acquired", "errors", "created_at"}}
+db_pools: Dict[str, Dict] = {}
+db_pools_lock = threading.Lock()
+
+def get_db_pool(db_name, db_user, db_password, db_host, db_port):
+    dsn = make_dsn(
+        dbname = db_name,
+        user = db_user,
+        password = db_password,
+        host = db_host,
+        port = db_port
+    )
+    with db_pools_lock:
+        entry = db_pools.get(dsn)
+        if entry is None:
+            entry = {
+                "pool": ThreadedConnectionPool(DB_POOL_MINCONN, DB_POOL_MAXCONN, dsn=dsn),
+                # ThreadedConnectionPool 在连接耗尽时直接报错，用信号量让调用方排队等待
+                "slots": threading.BoundedSemaphore(DB_POOL_MAXCONN),
+                "in_use": 0,
+                "acquired": 0,
+                "errors": 0,
+                "created_at": time.time(),
+                "db": f"{db_user}@{db_host}:{db_port}/{db_name}"
+            }
+            db_pools[dsn] = entry
+    return entry
+
+@contextmanager
+def pooled_connection(db_name, db_user, db_password, db_host, db_port):
     try:
-        connection = psycopg2.connect(
-            database = db_name,
-            user = db_user,
-            password = db_password,
-            host = db_host,
-            port = db_port
-        )
+        entry = get_db_pool(db_name, db_user, db_password, db_host, db_port)
     except OperationalError as e:
         print(f"连接错误：{e}")
-    return connection
+        yield None
+        return
+    if not entry["slots"].acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT):
+        print("连接错误：等待连接池空闲连接超时")
+        yield None
+        return
+    connection = None
+    try:
+        try:
+            connection = entry["pool"].getconn()
+        except OperationalError as e:
+            with db_pools_lock:
+                entry["errors"] += 1
+            print(f"连接错误：{e}")
+        with db_pools_lock:
+            if connection is not None:
+                entry["in_use"] += 1
+                entry["acquired"] += 1
+        yield connection
+    finally:
+        if connection is not None:
+            with db_pools_lock:
+                entry["in_use"] -= 1
+            broken = connection.closed != 0
+            if not broken:
+                try:
+                    # 归还前清理未结束的事务，避免下一个使用者继承脏状态
+                    connection.rollback()
+                except Exception:
+                    broken = True
+            entry["pool"].putconn(connection, close=broken)
+        entry["slots"].release()
 
 def table_exists(connection, table_name):
     if connection is None:
@@ -101,7 +213,7 @@ def table_exists(connection, table_name):
 def get_table_column_count(connection, table_name):
     if connection is None:
         return -1
-    cursor = connection.cursor
+    cursor = connection.cursor()
     try:
         cursor.execute(
             """
@@ -199,20 +311,53 @@ def insert_csv_to_postgres(connection, table_name, csv_file_path, batch_size=100
     finally:
         cursor.close()
         
+def import_csv_to_postgres_blocking(req: ImportCSVRequest):
+    with pooled_connection(
+        req.db_name, req.db_user, req.db_password, req.db_host, req.db_port
+    ) as connection:
+        if not connection:
+            return False, "数据库连接失败"
+        return insert_csv_to_postgres(connection, req.table_name, req.csv_file_path)
+
 @app.post("/import_csv_to_postgres")
 async def import_csv_to_postgres_api(req: ImportCSVRequest = Body(...)):
-    connection = create_db_connection(
-        req.db_name, req.db_user, req.db_password, req.db_host, req.db_port
-    )
-    if not connection:
-        return {"status": "error", "message": "数据库连接失败"}
-    result, msg = insert_csv_to_postgres(connection, req.table_name, req.csv_file_path)
-    connection.close()
+    # 读 CSV 和写库都是阻塞操作，放到线程池执行，避免阻塞事件循环
+    result, msg = await run_in_threadpool(import_csv_to_postgres_blocking, req)
     if result:
         return {"status": "success", "message": msg}
     else:
         return {"status": "error", "message": msg}
 
+@app.get("/db_pool_status")
+async def db_pool_status():
+    pools = []
+    with db_pools_lock:
+        entries = list(db_pools.values())
+    for entry in entries:
+        pool = entry["pool"]
+        pools.append({
+            "db": entry["db"],
+            "closed": pool.closed,
+            "max_connections": DB_POOL_MAXCONN,
+            "in_use": entry["in_use"],
+            "available": DB_POOL_MAXCONN - entry["in_use"],
+            "total_acquired": entry["acquired"],
+            "errors": entry["errors"],
+            "created_at": entry["created_at"]
+        })
+    return {
+        "status": "success",
+        "count": len(pools),
+        "pools": pools
+    }
+
+@app.on_event("shutdown")
+def close_db_pools():
+    with db_pools_lock:
+        for entry in db_pools.values():
+            entry["pool"].closeall()
+        db_pools.clear()
+
 @app.post("/submit_form")
 async def submit_form(data: List[FormData] = Body(...)):
     config_list = []
@@ -227,8 +372,18 @@ async def submit_form(data: List[FormData] = Body(...)):
                 "next_page": item.next_page
             }
         }
+        if item.attachments:
+            entry["selectors"]["attachments"] = item.attachments
+        if item.date:
+            entry["selectors"]["date"] = item.date
+        if item.detail_title:
+            entry["selectors"]["detail_title"] = item.detail_title
         if item.regex_replacements:
             entry["regex_replacements"] = item.regex_replacements
+        if item.discovery:
+            entry["discovery"] = item.discovery
+        if item.render:
+            entry["render"] = item.render
         config_list.append(entry)
     filename = "./config.json"
     with open(filename, 'w', encoding='utf-8') as f:
@@ -239,106 +394,472 @@ async def submit_form(data: List[FormData] = Body(...)):
         "data": config_list
     }
 
-def scrapy_output_reader(process, queue):
-    while process.poll() is None:
-        line = process.stdout.readline()
-        if not line:
-            break
-        pattern = r"\[gov_policy\]"
-        if re.search(pattern, line):
-            queue.put(line)
-    remaining_output = process.stdout.read() if process.stdout else ""
-    if remaining_output:
-        for line in remaining_output.splitlines(keepends=True):
-            if re.search(pattern, line):
-                queue.put(line)
+PREVIEW_DEFAULT_RENDER = "splash"
+PREVIEW_CACHE_TTL = 300
+PREVIEW_CACHE_SIZE = 64
+PREVIEW_RENDER_TIMEOUT = 60
+# 与爬虫使用相同的 Splash 地址和请求头，预览结果和实际抓取一致
+PREVIEW_SPLASH_URL = GovPolicySpider.custom_settings["SPLASH_URL"]
+PREVIEW_HEADERS = GovPolicySpider.custom_settings["DEFAULT_REQUEST_HEADERS"]
+
+# 渲染结果缓存，所有预览请求共享：{(后端, url, 等待秒数): (过期时间, 已解析的 HtmlResponse, 渲染耗时ms)}
+preview_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+# 正在渲染的页面，同一页面的并发预览只渲染一次
+preview_inflight: Dict[tuple, asyncio.Task] = {}
+preview_browser: Optional[BrowserPool] = None
+
+class PreviewLog:
+    """收集正则替换产生的错误和警告，随预览结果返回"""
+    def __init__(self):
+        self.messages = []
+
+    def error(self, msg):
+        self.messages.append(msg)
+
+    warning = error
+
+def fetch_rendered(backend, url, wait):
+    if backend == "splash":
+        query = urllib.parse.urlencode({"url": url, "wait": wait, "timeout": PREVIEW_RENDER_TIMEOUT})
+        target = f"{PREVIEW_SPLASH_URL.rstrip('/')}/render.html?{query}"
+    else:
+        target = url
+    req = urllib.request.Request(target, headers=PREVIEW_HEADERS)
+    with urllib.request.urlopen(req, timeout=PREVIEW_RENDER_TIMEOUT + 10) as resp:
+        final_url = url if backend == "splash" else resp.geturl()
+        return final_url, resp.read(), resp.headers.get("Content-Type", "text/html")
+
+async def render_uncached(key):
+    global preview_browser
+    backend, url, wait = key
+    start = time.monotonic()
+    if backend == "browser":
+        if preview_browser is None:
+            preview_browser = BrowserPool(1, "chromium", True, PREVIEW_RENDER_TIMEOUT)
+        final_url, _, html = await preview_browser.render(url, wait)
+        response = HtmlResponse(url=final_url, body=html, encoding="utf-8")
+    else:
+        final_url, body, content_type = await run_in_threadpool(fetch_rendered, backend, url, wait)
+        response = HtmlResponse(url=final_url, body=body, headers={"Content-Type": content_type})
+    # 预先解析 DOM，后续预览只做 XPath 求值
+    response.selector
+    render_ms = round((time.monotonic() - start) * 1000)
+    preview_cache[key] = (time.monotonic() + PREVIEW_CACHE_TTL, response, render_ms)
+    preview_cache.move_to_end(key)
+    while len(preview_cache) > PREVIEW_CACHE_SIZE:
+        preview_cache.popitem(last=False)
+    return response, render_ms
+
+async def render_page(options, kind, url, refresh=False):
+    """返回 (response, 渲染耗时ms, 是否命中缓存)"""
+    key = (options["backend"], url, options[f"{kind}_wait"])
+    cached = preview_cache.get(key)
+    if cached and not refresh and cached[0] > time.monotonic():
+        preview_cache.move_to_end(key)
+        return cached[1], cached[2], True
+    task = preview_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(render_uncached(key))
+        preview_inflight[key] = task
+        task.add_done_callback(lambda _: preview_inflight.pop(key, None))
+    # 请求方断开时不取消渲染，其他等待同一页面的预览仍可使用结果
+    response, render_ms = await asyncio.shield(task)
+    return response, render_ms, False
+
+def check_xpaths(response, fields):
+    errors = {}
+    for name, xpath in fields.items():
+        if xpath and xpath.strip():
+            try:
+                response.xpath(xpath)
+            except ValueError as e:
+                errors[name] = str(e)
+    return errors
+
+@app.post("/preview")
+async def preview(req: PreviewRequest = Body(...)):
+    try:
+        options = render_options({"render": req.render}, PREVIEW_DEFAULT_RENDER)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    selectors = {"title": req.title, "link": req.link, "content": req.content or {}}
+    if req.detail_title:
+        selectors["detail_title"] = req.detail_title
+    if req.attachments:
+        selectors["attachments"] = req.attachments
+    regex_replacements = req.regex_replacements or {}
+    log = PreviewLog()
+    result = {"list": None, "detail": None, "errors": {}, "messages": log.messages}
+
+    try:
+        response, render_ms, cached = await render_page(options, "list", req.url, req.refresh)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"列表页渲染失败: {e}")
+    start = time.perf_counter()
+    result["errors"] = check_xpaths(response, {"title": req.title, "link": req.link, "next_page": req.next_page})
+    if result["errors"]:
+        return result
+    titles, links, entries = extract_list(response, selectors, regex_replacements, logger=log)
+    if len(titles) != len(links):
+        log.warning(f"标题数 {len(titles)} 与链接数 {len(links)} 不一致，多出的部分会被忽略")
+    next_href = response.xpath(req.next_page).get() if req.next_page else None
+    result["list"] = {
+        "url": req.url,
+        "cached": cached,
+        "render_ms": render_ms,
+        "eval_ms": round((time.perf_counter() - start) * 1000, 2),
+        "title_count": len(titles),
+        "link_count": len(links),
+        "entries": [{"title": title, "url": url} for title, url in entries[:req.limit]],
+        "next_page": response.urljoin(next_href) if next_href else None,
+    }
+
+    detail_url = req.detail_url or (entries[0][1] if entries else None)
+    if not detail_url or not req.content:
+        return result
+    title = next((title for title, url in entries if url == detail_url), "")
+    try:
+        detail, render_ms, cached = await render_page(options, "detail", detail_url, req.refresh)
+    except Exception as e:
+        result["errors"]["detail"] = f"详情页渲染失败: {e}"
+        return result
+    start = time.perf_counter()
+    fields = dict(req.content, detail_title=req.detail_title, attachments=req.attachments)
+    result["errors"] = check_xpaths(detail, fields)
+    if result["errors"]:
+        return result
+    item = extract_detail(detail, req.name or "", title, selectors, regex_replacements, logger=log)
+    result["detail"] = {
+        "url": detail_url,
+        "cached": cached,
+        "render_ms": render_ms,
+        "eval_ms": round((time.perf_counter() - start) * 1000, 2),
+        "item": item,
+    }
+    return result
+
+@app.on_event("shutdown")
+async def close_preview_browser():
+    if preview_browser is not None:
+        await preview_browser.close()
+
+JOB_LOG_DIR = "logs"
+
+def scrapy_event_reader(process, server, queue):
+    # 爬虫通过 EventChannel 把 JSON 行事件写到本地 socket，这里原样转发，不做逐行匹配
+    connection = None
+    try:
+        server.settimeout(1)
+        while connection is None and process.poll() is None:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+        if connection is not None:
+            connection.settimeout(None)
+            with connection.makefile("r", encoding="utf-8") as events:
+                for line in events:
+                    queue.put(line)
+    finally:
+        if connection is not None:
+            connection.close()
+        server.close()
+        process.wait()
     pid = process.pid
     if pid in scrapy_instances:
         del scrapy_instances[pid]
+    finish_job(process)
 
 async def run_scrapy_command(pid: int, address = None):
+    queue = scrapy_instances[pid]["queue"]
     while True:
         try:
-            queue = scrapy_instances[pid]["queue"]
-            line = queue.get(timeout=0.1)
-            yield line
-        except:
-            if pid not in scrapy_instances or scrapy_instances[pid]["process"].poll() is not None:
+            # 不在事件循环里阻塞等待；实例结束后继续把队列中剩余的事件发完
+            yield queue.get_nowait()
+        except Empty:
+            if pid not in scrapy_instances:
                 break
             await asyncio.sleep(0.1)
 
-@app.post("/start_scrapy")
-async def start_scrapy(address: AddressData = Body(...)):
-    try:
-        cmd = ["scrapy", "crawl", "gov_policy"]
-        if address.address:
-            cmd.extend(["-o", address.address])
-            pipelines_str = ""
-            cmd.extend(["-s", f"ITEM_PIPELINES={pipelines_str}"])
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-        )
-        output_queue = Queue()
-        pid = process.pid
-        scrapy_instances[pid] = {
-            "process": process,
-            "queue": output_queue
-        }
-        t = threading.Thread(
-            target=scrapy_output_reader, 
-            args=(process, output_queue)
+def build_file_command(address: Optional[str]):
+    cmd = ["scrapy", "crawl", "gov_policy"]
+    if address:
+        cmd.extend(["-o", address])
+        pipelines_str = ""
+        cmd.extend(["-s", f"ITEM_PIPELINES={pipelines_str}"])
+    return cmd
+
+def build_postgres_command(postgresConfig: PostgresConfig):
+    cmd = ["scrapy", "crawl", "gov_policy"]
+    cmd.extend(["-s", f"POSTGRES_DBNAME={postgresConfig.dbname}"])
+    cmd.extend(["-s", f"POSTGRES_USER={postgresConfig.user}"])
+    cmd.extend(["-s", f"POSTGRES_PASSWORD={postgresConfig.password}"])
+    cmd.extend(["-s", f"POSTGRES_HOST={postgresConfig.host}"])
+    cmd.extend(["-s", f"POSTGRES_PORT={postgresConfig.port}"])
+    cmd.extend(["-s", f"POSTGRES_TABLE={postgresConfig.table}"])
+    if postgresConfig.storage_mode:
+        cmd.extend(["-s", f"POSTGRES_STORAGE_MODE={postgresConfig.storage_mode}"])
+    if postgresConfig.partition_by:
+        cmd.extend(["-s", f"POSTGRES_PARTITION_BY={postgresConfig.partition_by}"])
+    if postgresConfig.retention_months is not None:
+        cmd.extend(["-s", f"POSTGRES_RETENTION_MONTHS={postgresConfig.retention_months}"])
+    return cmd
+
+# 准入控制：同时运行的爬虫数上限，超出的任务排队等待
+MAX_RUNNING_JOBS = int(os.environ.get("MAX_RUNNING_JOBS", 2))
+# 单个任务默认资源上限：内存（MB，进程树 RSS）和 CPU（核数），可用同名环境变量按机器配置调整
+JOB_MEMORY_LIMIT_MB = int(os.environ.get("JOB_MEMORY_LIMIT_MB", 2048))
+JOB_CPU_LIMIT = float(os.environ.get("JOB_CPU_LIMIT", 1.0))
+JOB_MONITOR_INTERVAL = 5
+# 超出内存预算后先发送中断信号让 Scrapy 优雅退出，超过宽限时间仍未退出则强制结束
+JOB_SHUTDOWN_GRACE = 60
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# {job_id: {"id", "cmd", "status", "pid", "memory_limit_mb", "cpu_limit", "queued_at", ...}}
+scrapy_jobs: Dict[str, Dict] = {}
+job_queue: List[str] = []
+job_lock = threading.RLock()
+
+def job_view(job):
+    view = {k: v for k, v in job.items() if k not in ("cmd", "process", "cgroup")}
+    if job["status"] == "queued":
+        view["position"] = job_queue.index(job["id"]) + 1
+    return view
+
+def submit_job(cmd, memory_limit_mb=None, cpu_limit=None, priority=0):
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "cmd": cmd,
+        "status": "queued",
+        "pid": None,
+        "memory_limit_mb": memory_limit_mb or JOB_MEMORY_LIMIT_MB,
+        "cpu_limit": cpu_limit or JOB_CPU_LIMIT,
+        "priority": priority,
+        "queued_at": time.time()
+    }
+    with job_lock:
+        scrapy_jobs[job["id"]] = job
+        # 按优先级排队，同优先级先进先出
+        position = next(
+            (i for i, job_id in enumerate(job_queue) if scrapy_jobs[job_id]["priority"] < priority),
+            len(job_queue)
         )
-        t.daemon = True
-        t.start()
+        job_queue.insert(position, job["id"])
+        dispatch_jobs()
+        return job_view(job)
+
+def dispatch_jobs():
+    with job_lock:
+        running = sum(1 for job in scrapy_jobs.values() if job["status"] in ("running", "stopping"))
+        while job_queue and running < MAX_RUNNING_JOBS:
+            job = scrapy_jobs[job_queue.pop(0)]
+            try:
+                launch_scrapy(job)
+                running += 1
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                print(f"任务 {job['id']} 启动失败：{e}")
+
+def limit_job_memory(job, pid):
+    # 硬上限只作兜底，正常情况下由监控线程在超出预算时优雅停止；
+    # 进程启动后再设置，不在 fork 出的子进程里执行 Python 代码（主进程有多个线程）
+    limit = job["memory_limit_mb"] * 2 * 1024 * 1024
+    try:
+        psutil.Process(pid).rlimit(psutil.RLIMIT_DATA, (limit, limit))
+    except (AttributeError, psutil.Error, OSError, ValueError):
+        pass
+
+def enable_cgroup_controllers(path, controllers=("memory", "cpu")):
+    with open(os.path.join(path, "cgroup.subtree_control")) as f:
+        enabled = f.read().split()
+    missing = [c for c in controllers if c not in enabled]
+    if missing:
+        with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+            f.write(" ".join(f"+{c}" for c in missing))
+
+def create_job_cgroup(job, pid):
+    """cgroup v2 可写时为任务建立独立 cgroup，设置内存和 CPU 上限"""
+    controllers_file = os.path.join(CGROUP_ROOT, "cgroup.controllers")
+    if not os.path.exists(controllers_file):
+        return None
+    parent = os.path.join(CGROUP_ROOT, "scrapy_jobs")
+    path = os.path.join(parent, f"job_{job['id']}")
+    try:
+        with open(controllers_file) as f:
+            if not {"memory", "cpu"} <= set(f.read().split()):
+                return None
+        # 子 cgroup 里的 memory.max/cpu.max 需要上级逐层开启对应控制器
+        enable_cgroup_controllers(CGROUP_ROOT)
+        os.makedirs(parent, exist_ok=True)
+        enable_cgroup_controllers(parent)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "memory.max"), "w") as f:
+            f.write(str(job["memory_limit_mb"] * 2 * 1024 * 1024))
+        with open(os.path.join(path, "cpu.max"), "w") as f:
+            f.write(f"{int(job['cpu_limit'] * 100000)} 100000")
+        with open(os.path.join(path, "cgroup.procs"), "w") as f:
+            f.write(str(pid))
+        return path
+    except OSError:
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return None
+
+def limit_job_cpu(job, pid):
+    # 没有 cgroup 时退而求其次，把进程绑定到有限的 CPU 核上，优先选其他运行中任务没有占用的核
+    try:
+        available = psutil.Process().cpu_affinity()
+        usage = {core: 0 for core in available}
+        with job_lock:
+            for other in scrapy_jobs.values():
+                if other is not job and other["status"] in ("running", "stopping"):
+                    for core in other.get("cpu_cores") or ():
+                        if core in usage:
+                            usage[core] += 1
+        count = min(len(available), max(1, math.ceil(job["cpu_limit"])))
+        cores = sorted(available, key=lambda core: (usage[core], core))[:count]
+        psutil.Process(pid).cpu_affinity(cores)
+        job["cpu_cores"] = cores
+    except (AttributeError, psutil.Error, ValueError):
+        pass
+
+def launch_scrapy(job):
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    host, port = server.getsockname()
+    cmd = job["cmd"] + ["-s", f"EVENTS_ADDRESS={host}:{port}"]
+    # 完整日志写入文件，供排查问题；实时进度走事件通道
+    os.makedirs(JOB_LOG_DIR, exist_ok=True)
+    job["log_file"] = os.path.join(JOB_LOG_DIR, f"scrapy_{job['id']}.log")
+    try:
+        with open(job["log_file"], "w", encoding="utf-8") as log_file:
+            process = subprocess.Popen(
+                cmd,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                **kwargs
+            )
+    except Exception:
+        server.close()
+        raise
+    output_queue = Queue()
+    pid = process.pid
+    limit_job_memory(job, pid)
+    job["cgroup"] = create_job_cgroup(job, pid)
+    if not job["cgroup"]:
+        limit_job_cpu(job, pid)
+    job.update({"status": "running", "pid": pid, "process": process, "started_at": time.time()})
+    scrapy_instances[pid] = {
+        "process": process,
+        "queue": output_queue,
+        "job_id": job["id"]
+    }
+    t = threading.Thread(
+        target=scrapy_event_reader,
+        args=(process, server, output_queue)
+    )
+    t.daemon = True
+    t.start()
+    m = threading.Thread(target=job_memory_monitor, args=(job,))
+    m.daemon = True
+    m.start()
+    return pid
+
+def send_stop_signal(p):
+    if hasattr(signal, "CTRL_BREAK_EVENT") and psutil.WINDOWS:
+        p.send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        p.send_signal(signal.SIGINT)
+
+def job_memory_monitor(job):
+    process = job["process"]
+    limit = job["memory_limit_mb"] * 1024 * 1024
+    stop_sent_at = None
+    while process.poll() is None:
+        try:
+            p = psutil.Process(process.pid)
+            rss = p.memory_info().rss + sum(c.memory_info().rss for c in p.children(recursive=True))
+            job["memory_mb"] = round(rss / 1024 / 1024, 1)
+            if stop_sent_at is None and rss > limit:
+                print(f"任务 {job['id']} 内存 {job['memory_mb']}MB 超出预算 {job['memory_limit_mb']}MB，正在停止")
+                job["status"] = "stopping"
+                job["stop_reason"] = "memory_exceeded"
+                send_stop_signal(p)
+                stop_sent_at = time.time()
+            elif stop_sent_at and time.time() - stop_sent_at > JOB_SHUTDOWN_GRACE:
+                for child in p.children(recursive=True):
+                    child.kill()
+                p.kill()
+        except psutil.Error:
+            break
+        time.sleep(JOB_MONITOR_INTERVAL)
+
+def finish_job(process):
+    with job_lock:
+        for job in scrapy_jobs.values():
+            if job.get("process") is process:
+                process.wait()
+                job["status"] = "finished"
+                job["returncode"] = process.returncode
+                job["finished_at"] = time.time()
+                job.pop("process", None)
+                if job.get("cgroup"):
+                    try:
+                        os.rmdir(job["cgroup"])
+                    except OSError:
+                        pass
+                break
+        dispatch_jobs()
+
+def job_response(job, message):
+    if job["status"] == "queued":
         return {
             "status": "success",
-            "pid": pid,
-            "stream_url": f"/stream_scrapy?pid={pid}",
-            "message": "爬虫已启动"
+            "queued": True,
+            "job_id": job["id"],
+            "position": job["position"],
+            "message": f"已达到同时运行上限，爬虫已排队（第 {job['position']} 位）"
         }
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"启动失败：{job.get('error')}")
+    pid = job["pid"]
+    return {
+        "status": "success",
+        "queued": False,
+        "job_id": job["id"],
+        "pid": pid,
+        "stream_url": f"/stream_scrapy?pid={pid}",
+        "message": message
+    }
+
+@app.post("/start_scrapy")
+async def start_scrapy(address: AddressData = Body(...)):
+    try:
+        job = submit_job(build_file_command(address.address), address.memory_limit_mb, address.cpu_limit)
+        return job_response(job, "爬虫已启动")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动失败：{str(e)}")
     
 @app.post("/start_scrapy_postgres")
-async def start_scrapy(postgresConfig: PostgresConfig = Body(...)):
+async def start_scrapy_postgres(postgresConfig: PostgresConfig = Body(...)):
     try:
-        cmd = ["scrapy", "crawl", "gov_policy"]
-        cmd.extend(["-s", f"POSTGRES_DBNAME={postgresConfig.dbname}"])
-        cmd.extend(["-s", f"POSTGRES_USER={postgresConfig.user}"])
-        cmd.extend(["-s", f"POSTGRES_PASSWORD={postgresConfig.password}"])
-        cmd.extend(["-s", f"POSTGRES_HOST={postgresConfig.host}"])
-        cmd.extend(["-s", f"POSTGRES_PORT={postgresConfig.port}"])
-        cmd.extend(["-s", f"POSTGRES_TABLE={postgresConfig.table}"])
-        process = subprocess.Popen(
-            cmd,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.STDOUT,
-            text = True,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-        )
-        output_queue = Queue()
-        pid = process.pid
-        scrapy_instances[pid] = {
-            "process": process,
-            "queue": output_queue
-        }
-        t = threading.Thread(
-            target=scrapy_output_reader,
-            args=(process, output_queue)
-        )
-        t.daemon = True
-        t.start()
+        cmd = build_postgres_command(postgresConfig)
+        job = submit_job(cmd, postgresConfig.memory_limit_mb, postgresConfig.cpu_limit)
         return {
-            "status": "success",
-            "pid": pid,
-            "stream_url": f"/stream_scrapy?pid={pid}",
-            "message": "爬虫已启动（PostgreSQL模式）",
+            **job_response(job, "爬虫已启动（PostgreSQL模式）"),
             "command": " ".join(cmd)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动失败：{str(e)}")
 
@@ -348,7 +869,7 @@ async def stream_scrapy(pid: int):
         raise HTTPException(status_code=404, detail="爬虫实例不存在或已结束")
     return StreamingResponse(
         run_scrapy_command(pid),
-        media_type="text/plain"
+        media_type="application/x-ndjson"
     )
 
 @app.post("/pause_scrapy")
@@ -388,10 +909,7 @@ async def stop_scrapy(req: ProcessRequest):
         return {"status": "error", "message": "爬虫实例不存在或已结束"}
     try:
         p = psutil.Process(pid)
-        if hasattr(signal, "CTRL_BREAK_EVENT") and psutil.WINDOWS:
-            p.send_signal(signal.CTRL_BREAK_EVENT)
-        else:
-            p.send_signal(signal.SIGINT)
+        send_stop_signal(p)
         return {"status": "success", "message": f"已终止 PID：{pid} 的爬虫进程"}
     except psutil.NoSuchProcess:
         if pid in scrapy_instances:
@@ -414,12 +932,268 @@ async def list_instances():
             })
         except:
             del scrapy_instances[pid]
+    with job_lock:
+        queued = [job_view(scrapy_jobs[job_id]) for job_id in job_queue]
     return {
         "status": "success",
         "count": len(instances),
-        "instances": instances
+        "instances": instances,
+        "queued": queued
     }
 
+@app.get("/job_status")
+async def job_status(job_id: str):
+    with job_lock:
+        job = scrapy_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        return {"status": "success", "job": job_view(job)}
+
+@app.post("/cancel_job")
+async def cancel_job(job_id: str = Body(..., embed=True)):
+    with job_lock:
+        if job_id not in job_queue:
+            return {"status": "error", "message": "任务不在等待队列中"}
+        job_queue.remove(job_id)
+        scrapy_jobs[job_id]["status"] = "cancelled"
+    return {"status": "success", "message": "已取消排队中的任务"}
+
+SCHEDULE_DB = "schedules.sqlite"
+SCHEDULER_TICK_SECONDS = 30
+# 同一时刻到期的任务之间的最小启动间隔，避免同时压向 Splash 和数据库
+SCHEDULER_STAGGER_SECONDS = 60
+
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+schedule_lock = threading.Lock()
+
+def parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"步长必须为正数：{field}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if high == 6:
+            # 星期字段允许用 7 表示周日
+            start, end = min(start, 7), min(end, 7)
+            if start == 7 and end == 7:
+                start = end = 0
+        if start < low or end > (7 if high == 6 else high) or start > end:
+            raise ValueError(f"取值超出范围 {low}-{high}：{field}")
+        values.update(v % 7 if high == 6 else v for v in range(start, end + 1, step))
+    return values
+
+def parse_cron(expr):
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("cron 表达式需为 5 段：分 时 日 月 周")
+    parsed = [parse_cron_field(f, low, high) for f, (low, high) in zip(fields, CRON_FIELDS)]
+    # 与标准 cron 一致：日和周都被限定时，满足其一即可
+    parsed.append(fields[2] != "*" and fields[4] != "*")
+    return parsed
+
+def cron_next(expr, after):
+    minutes, hours, days, months, weekdays, day_or = parse_cron(expr)
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 4)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        dom_ok = t.day in days
+        dow_ok = (t.weekday() + 1) % 7 in weekdays
+        if not ((dom_ok or dow_ok) if day_or else (dom_ok and dow_ok)):
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minutes:
+            t += timedelta(minutes=1)
+            continue
+        return t
+    raise ValueError(f"cron 表达式在四年内没有可执行时间：{expr}")
+
+def schedule_db():
+    connection = sqlite3.connect(SCHEDULE_DB)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            cron TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            stagger_seconds INTEGER NOT NULL DEFAULT 0,
+            params TEXT NOT NULL,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            last_run REAL,
+            last_job_id TEXT,
+            next_run REAL
+        )
+        """
+    )
+    return connection
+
+def schedule_to_dict(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    if job["params"].get("postgres"):
+        job["params"]["postgres"] = {**job["params"]["postgres"], "password": "******"}
+    job["enabled"] = bool(job["enabled"])
+    return job
+
+def schedule_command(params):
+    if params.get("postgres"):
+        return build_postgres_command(PostgresConfig(**params["postgres"]))
+    return build_file_command(params.get("address"))
+
+def take_due_schedules(now):
+    with schedule_lock:
+        connection = schedule_db()
+        try:
+            rows = connection.execute(
+                "SELECT * FROM schedules WHERE enabled = 1 AND next_run <= ? ORDER BY priority DESC, next_run, id",
+                (now.timestamp(),)
+            ).fetchall()
+            for row in rows:
+                # 先推进 next_run，保证同一次到期只触发一次
+                next_run = cron_next(row["cron"], now).timestamp()
+                connection.execute(
+                    "UPDATE schedules SET last_run = ?, next_run = ? WHERE id = ?",
+                    (now.timestamp(), next_run, row["id"])
+                )
+            connection.commit()
+            return [dict(row) for row in rows]
+        finally:
+            connection.close()
+
+async def run_scheduled_job(job, delay):
+    if delay > 0:
+        await asyncio.sleep(delay)
+    try:
+        queued_job = submit_job(schedule_command(json.loads(job["params"])), priority=job["priority"])
+        with schedule_lock:
+            connection = schedule_db()
+            try:
+                connection.execute("UPDATE schedules SET last_job_id = ? WHERE id = ?", (queued_job["id"], job["id"]))
+                connection.commit()
+            finally:
+                connection.close()
+        print(f"定时任务 {job['name']} 已提交，任务 ID: {queued_job['id']}，状态: {queued_job['status']}")
+    except Exception as e:
+        print(f"定时任务 {job['name']} 启动失败：{e}")
+
+async def scheduler_loop():
+    while True:
+        try:
+            due = await run_in_threadpool(take_due_schedules, datetime.now())
+            offset = 0
+            for index, job in enumerate(due):
+                # 按优先级依次错开启动，间隔取全局间隔和任务自身间隔的较大者
+                if index > 0:
+                    offset += max(SCHEDULER_STAGGER_SECONDS, job["stagger_seconds"])
+                else:
+                    offset = job["stagger_seconds"]
+                asyncio.create_task(run_scheduled_job(job, offset))
+        except Exception as e:
+            print(f"调度器执行出错：{e}")
+        await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+@app.on_event("startup")
+async def start_scheduler():
+    app.state.scheduler_task = asyncio.create_task(scheduler_loop())
+
+@app.post("/schedules")
+async def create_schedule(req: ScheduleRequest = Body(...)):
+    try:
+        next_run = cron_next(req.cron, datetime.now())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"cron 表达式无效：{e}")
+    params = {
+        "address": req.address,
+        "postgres": req.postgres.dict() if req.postgres else None
+    }
+    with schedule_lock:
+        connection = schedule_db()
+        try:
+            cursor = connection.execute(
+                """
+                INSERT INTO schedules (name, cron, priority, stagger_seconds, params, enabled, next_run)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (req.name, req.cron, req.priority, req.stagger_seconds,
+                 json.dumps(params, ensure_ascii=False), int(req.enabled), next_run.timestamp())
+            )
+            connection.commit()
+            job_id = cursor.lastrowid
+        finally:
+            connection.close()
+    return {
+        "status": "success",
+        "id": job_id,
+        "next_run": next_run.isoformat(),
+        "message": "定时任务已创建"
+    }
+
+@app.get("/schedules")
+async def list_schedules():
+    with schedule_lock:
+        connection = schedule_db()
+        try:
+            rows = connection.execute("SELECT * FROM schedules ORDER BY priority DESC, next_run").fetchall()
+        finally:
+            connection.close()
+    jobs = [schedule_to_dict(row) for row in rows]
+    return {
+        "status": "success",
+        "count": len(jobs),
+        "schedules": jobs
+    }
+
+@app.post("/schedules/{job_id}/toggle")
+async def toggle_schedule(job_id: int, req: ScheduleToggle = Body(...)):
+    with schedule_lock:
+        connection = schedule_db()
+        try:
+            row = connection.execute("SELECT cron FROM schedules WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return {"status": "error", "message": "定时任务不存在"}
+            # 重新启用时从当前时间重新计算，避免补跑停用期间错过的任务
+            next_run = cron_next(row["cron"], datetime.now()).timestamp()
+            connection.execute(
+                "UPDATE schedules SET enabled = ?, next_run = ? WHERE id = ?",
+                (int(req.enabled), next_run, job_id)
+            )
+            connection.commit()
+        finally:
+            connection.close()
+    return {"status": "success", "message": "定时任务已启用" if req.enabled else "定时任务已停用"}
+
+@app.delete("/schedules/{job_id}")
+async def delete_schedule(job_id: int):
+    with schedule_lock:
+        connection = schedule_db()
+        try:
+            deleted = connection.execute("DELETE FROM schedules WHERE id = ?", (job_id,)).rowcount
+            connection.commit()
+        finally:
+            connection.close()
+    if not deleted:
+        return {"status": "error", "message": "定时任务不存在"}
+    return {"status": "success", "message": "定时任务已删除"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)